@@ -1,8 +1,12 @@
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from utils import normalize_direction, parse_dt, format_duration
 
+# worktime event, by position (db.WORKTIME_COLUMNS):
+# employeeID, authDateTime, direction, personName, cardNo
+Event = Tuple[Any, Any, Any, Any, Any]
+
 def compute_summary(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     events_sorted = sorted(events, key=lambda x: int(x.get("serialNo", 0)), reverse=True)
 
@@ -31,53 +35,149 @@ def compute_summary(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     out.sort(key=lambda x: (x["personName"], x["employeeID"]))
     return out
 
-def compute_worktime(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    by_emp: Dict[str, List[Dict[str, Any]]] = {}
+def _as_dt(v: Any) -> datetime:
+    # pyodbc already returns datetime; strings come from API dicts
+    if isinstance(v, datetime):
+        return v
+    if isinstance(v, str):
+        try:
+            return datetime.fromisoformat(v)  # "YYYY-MM-DD HH:MM:SS", far cheaper than strptime
+        except ValueError:
+            pass
+    return parse_dt(v) or datetime.min
+
+class WorktimeFold:
+    """
+    In/out pairing state for one employee; feed events in time order.
+    Folds of consecutive periods (e.g. days) can be merged, which is what the
+    daily rollup relies on.
+    """
+
+    __slots__ = ("employeeID", "person_name", "card_no", "total", "first_in", "last_out", "open_in",
+                 "lead_out", "unmatched")
+
+    def __init__(self, emp: str):
+        self.employeeID = emp
+        self.person_name = ""
+        self.card_no = ""
+        self.total = timedelta(0)
+        self.first_in: Optional[datetime] = None
+        self.last_out: Optional[datetime] = None
+        self.open_in: Optional[datetime] = None
+        # first exit before any entry: closes an entry from the previous period
+        self.lead_out: Optional[datetime] = None
+        # exits without an entry and entries replaced by another entry
+        self.unmatched = 0
+
+    def add(self, e: Event) -> None:
+        _, ts, direction, name, card = e
+        self.person_name = name or self.person_name
+        self.card_no = card or self.card_no
+
+        dt = _as_dt(ts)
+        d = normalize_direction(direction)
+
+        if d == "vhod":
+            if self.first_in is None:
+                self.first_in = dt
+            if self.open_in is not None:
+                self.unmatched += 1
+            self.open_in = dt
+        elif d == "vihod":
+            if self.first_in is None and self.lead_out is None:
+                self.lead_out = dt
+            self.last_out = dt
+            if self.open_in is None:
+                self.unmatched += 1
+            elif dt >= self.open_in:
+                self.total += (dt - self.open_in)
+            self.open_in = None
+
+    def merge(self, later: "WorktimeFold") -> None:
+        """Append the fold of a later period, as if its events were added here."""
+        if self.first_in is None and self.lead_out is None:
+            self.lead_out = later.lead_out
+        if later.lead_out is not None:
+            if self.open_in is not None:
+                if later.lead_out >= self.open_in:
+                    self.total += (later.lead_out - self.open_in)
+                self.unmatched -= 1  # that exit had an entry after all
+            self.open_in = None
+        elif later.first_in is not None and self.open_in is not None:
+            self.unmatched += 1
+
+        self.total += later.total
+        self.unmatched += later.unmatched
+        if later.first_in is not None:
+            self.open_in = later.open_in
+            if self.first_in is None:
+                self.first_in = later.first_in
+        if later.last_out is not None:
+            self.last_out = later.last_out
+        self.person_name = later.person_name or self.person_name
+        self.card_no = later.card_no or self.card_no
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "employeeID": self.employeeID,
+            "personName": self.person_name,
+            "cardNo": self.card_no,
+            "firstIn": self.first_in.strftime("%Y-%m-%d %H:%M:%S") if self.first_in else "",
+            "lastOut": self.last_out.strftime("%Y-%m-%d %H:%M:%S") if self.last_out else "",
+            "totalInside": format_duration(self.total),
+        }
+
+def iter_folds(events: Iterable[Event]) -> Iterator[WorktimeFold]:
+    """
+    One pass over events already ordered by (employeeID, authDateTime).
+    Yields each employee's fold as soon as the next employee starts, so
+    memory does not depend on the number of events.
+    """
+    fold: Optional[WorktimeFold] = None
     for e in events:
-        emp = str(e.get("employeeID") or "").strip()
+        emp = str(e[0] or "").strip()
         if not emp:
             continue
-        by_emp.setdefault(emp, []).append(e)
-
-    result = []
-    for emp, lst in by_emp.items():
-        def e_dt(x):
-            return parse_dt(x.get("authDateTime")) or datetime.min
-
-        lst_sorted = sorted(lst, key=e_dt)
-
-        total = timedelta(0)
-        first_in: Optional[datetime] = None
-        last_out: Optional[datetime] = None
-        person_name = ""
-        card_no = ""
-        open_in: Optional[datetime] = None
-
-        for e in lst_sorted:
-            person_name = e.get("personName") or person_name
-            card_no = e.get("cardNo") or card_no
-
-            dt = e_dt(e)
-            d = normalize_direction(e.get("direction"))
-
-            if d == "vhod":
-                if first_in is None:
-                    first_in = dt
-                open_in = dt
-            elif d == "vihod":
-                last_out = dt
-                if open_in is not None and dt >= open_in:
-                    total += (dt - open_in)
-                open_in = None
-
-        result.append({
-            "employeeID": emp,
-            "personName": person_name,
-            "cardNo": card_no,
-            "firstIn": first_in.strftime("%Y-%m-%d %H:%M:%S") if first_in else "",
-            "lastOut": last_out.strftime("%Y-%m-%d %H:%M:%S") if last_out else "",
-            "totalInside": format_duration(total),
-        })
+        if fold is None or fold.employeeID != emp:
+            if fold is not None:
+                yield fold
+            fold = WorktimeFold(emp)
+        fold.add(e)
+    if fold is not None:
+        yield fold
 
+def iter_day_folds(events: Iterable[Event]) -> Iterator[Tuple[date, WorktimeFold]]:
+    """Like iter_folds, but one fold per employee and calendar day."""
+    fold: Optional[WorktimeFold] = None
+    day: Optional[date] = None
+    for e in events:
+        emp = str(e[0] or "").strip()
+        if not emp:
+            continue
+        d = _as_dt(e[1]).date()
+        if fold is None or fold.employeeID != emp or day != d:
+            if fold is not None:
+                yield day, fold
+            fold, day = WorktimeFold(emp), d
+        fold.add(e)
+    if fold is not None:
+        yield day, fold
+
+def iter_worktime(events: Iterable[Event]) -> Iterator[Dict[str, Any]]:
+    for fold in iter_folds(events):
+        yield fold.result()
+
+def compute_worktime_folds(folds: Iterable[WorktimeFold]) -> List[Dict[str, Any]]:
+    result = [fold.result() for fold in folds]
     result.sort(key=lambda x: (x["personName"], x["employeeID"]))
     return result
+
+def compute_worktime_stream(events: Iterable[Event]) -> List[Dict[str, Any]]:
+    return compute_worktime_folds(iter_folds(events))
+
+def compute_worktime(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Worktime of unordered event dicts (API rows)."""
+    rows = [(e.get("employeeID"), e.get("authDateTime"), e.get("direction"), e.get("personName"), e.get("cardNo"))
+            for e in events]
+    rows.sort(key=lambda r: (str(r[0] or "").strip(), _as_dt(r[1])))
+    return compute_worktime_stream(rows)
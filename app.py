@@ -1,14 +1,29 @@
 import os
-import json
-import time
+import atexit
 import logging
+import time
+from datetime import date, datetime, timedelta
+from functools import wraps
 from logging.handlers import RotatingFileHandler
-from typing import Dict
+from typing import Any, Dict, List, Optional, Tuple
 
-from flask import Flask, Response, jsonify, render_template_string, request
+from flask import Flask, Response, g, jsonify, render_template_string, request
+from flask.json.provider import DefaultJSONProvider
 
 import db
-from analytics import compute_summary, compute_worktime
+import metrics
+from analytics import compute_summary, compute_worktime_folds, compute_worktime_stream
+from cache import ResponseCache, make_etag
+from export import csv_chunks
+from feed import LiveFeed, Subscriber, sse_message
+from mirror import Mirror
+from normalize import TextNormalizer
+from occupancy import OccupancyStore
+from parallel import WorktimePool
+from people import PersonDirectory
+from presence import PresenceState
+from rollup import WorktimeRollup
+from tail import make_tail
 from templates import HTML
 from utils import now_str
 
@@ -27,27 +42,20 @@ logger.setLevel(logging.INFO)
 
 _formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 
-# file (rotating)
-_file_handler = RotatingFileHandler(
-    LOG_FILE,
-    maxBytes=5 * 1024 * 1024,  # 5 MB
-    backupCount=5,
-    encoding="utf-8",
-)
-_file_handler.setFormatter(_formatter)
-logger.addHandler(_file_handler)
+# ===== FLASK =====
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify() with its encoding time recorded per endpoint."""
 
-# console (useful for manual запуск)
-_console = logging.StreamHandler()
-_console.setFormatter(_formatter)
-logger.addHandler(_console)
+    def response(self, *args, **kwargs):
+        with metrics.JSON_ENCODE.time(request.endpoint or "other"):
+            return super().response(*args, **kwargs)
 
-logger.info("=== iVMS access log service starting ===")
 
-# ===== FLASK =====
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 
-DB_CONN_STR = (
+# IVMS_DB_CONN_STR overrides, e.g. sqlite:///bench/attlog.db (see sqlitedb.py)
+DB_CONN_STR = os.getenv("IVMS_DB_CONN_STR") or (
     "DRIVER={SQL Server Native Client 11.0};"
     "SERVER=127.0.0.1;"
     "DATABASE=thirdparty;"
@@ -56,11 +64,182 @@ DB_CONN_STR = (
     "TrustServerCertificate=yes;"
 )
 
-TABLE_NAME = "dbo.attlog"
+TABLE_NAME = os.getenv("IVMS_TABLE", "dbo.attlog")
+
+# presence snapshot, worktime rollup
+STATE_DIR = os.getenv("IVMS_STATE_DIR", BASE_DIR)
 
 MAX_PAGE_ROWS = 300
 MAX_SSE_BATCH = 50
-SSE_POLL_SECONDS = 1.0
+# live tail: poll (adaptive sleep), ct (Change Tracking version probe), waitfor (long poll in SQL Server)
+LIVE_TAIL = os.getenv("IVMS_LIVE_TAIL", "poll")
+# poll: wait after a poll with rows .. wait after a long idle spell;
+# ct: probe interval .. forced poll; waitfor: WAITFOR step .. longest server-side wait
+LIVE_MIN_SECONDS = float(os.getenv("IVMS_LIVE_MIN_SECONDS", "0.25"))
+LIVE_MAX_SECONDS = float(os.getenv("IVMS_LIVE_MAX_SECONDS", "3"))
+SSE_PING_SECONDS = 15.0
+SSE_BUFFER_ROWS = 5000
+SSE_CLIENT_QUEUE = 200
+SSE_WORKTIME_DELTA_SECONDS = 5.0
+# a reconnect that missed more rows than this reloads instead of replaying
+SSE_REPLAY_ROWS = int(os.getenv("IVMS_SSE_REPLAY_ROWS", "5000"))
+
+# one DB poller shared by all /sse clients; its tail is set by start_service()
+live = LiveFeed(
+    DB_CONN_STR,
+    TABLE_NAME,
+    batch_size=MAX_SSE_BATCH,
+    buffer_size=SSE_BUFFER_ROWS,
+    queue_size=SSE_CLIENT_QUEUE,
+    worktime_delta_seconds=SSE_WORKTIME_DELTA_SECONDS,
+)
+
+# encoded /api/log, /api/summary, /api/worktime responses
+CACHE_MB = int(os.getenv("IVMS_CACHE_MB", "64"))
+response_cache = ResponseCache(CACHE_MB * 1024 * 1024)
+
+# employeeID -> last event, fed by the live tail; snapshot survives restarts
+PRESENCE_SNAPSHOT = os.path.join(STATE_DIR, "STATE_presence.json")
+presence = PresenceState(DB_CONN_STR, TABLE_NAME, PRESENCE_SNAPSHOT)
+live.add_listener(presence.apply_rows)
+
+
+# search box text -> employeeIDs (trigram index over distinct people)
+PEOPLE_INDEX = os.getenv("IVMS_PEOPLE_INDEX", "1") == "1"
+people = PersonDirectory(DB_CONN_STR, TABLE_NAME, max_ids=int(os.getenv("IVMS_SEARCH_MAX_IDS", "500")))
+if PEOPLE_INDEX:
+    db.SEARCH_RESOLVER = people.resolve
+    live.add_listener(people.add_rows)
+
+
+# text match keys in <table>_text (create it with migrate.py first)
+NORMALIZE = os.getenv("IVMS_NORMALIZE", "0") == "1"
+normalizer = TextNormalizer(DB_CONN_STR, TABLE_NAME, f"{TABLE_NAME}_text")
+if NORMALIZE:
+    db.TEXT_COVERAGE = normalizer.coverage
+
+
+# local SQLite copy of the table with repaired text; history reads go there
+# once it has caught up (the live feed, rollup and search index use the source)
+MIRROR = os.getenv("IVMS_MIRROR", "0") == "1"
+mirror = Mirror(
+    DB_CONN_STR,
+    TABLE_NAME,
+    os.path.join(STATE_DIR, "STATE_mirror.sqlite"),
+    max_lag=int(os.getenv("IVMS_MIRROR_MAX_LAG", "1000")),
+    verify_seconds=float(os.getenv("IVMS_MIRROR_VERIFY_SECONDS", "3600")),
+)
+if MIRROR:
+    live.add_listener(mirror.notify)
+
+
+# entries / exits / people inside per 15 minutes and door (local SQLite)
+OCCUPANCY = os.getenv("IVMS_OCCUPANCY", "1") == "1"
+occupancy = OccupancyStore(
+    DB_CONN_STR,
+    TABLE_NAME,
+    os.path.join(STATE_DIR, "STATE_occupancy.sqlite"),
+    days=int(os.getenv("IVMS_OCCUPANCY_DAYS", "90")),
+)
+if OCCUPANCY:
+    live.add_listener(occupancy.notify)
+
+
+# per-employee per-day worktime for closed days (local SQLite)
+WORKTIME_ROLLUP = os.getenv("IVMS_WORKTIME_ROLLUP", "1") == "1"
+rollup = WorktimeRollup(DB_CONN_STR, TABLE_NAME, os.path.join(STATE_DIR, "STATE_worktime.sqlite"))
+
+# worktime that the rollup cannot answer (door/time filters, exports) is
+# split by employeeID across this many processes; 0/1 = in the request thread
+worktime_pool = WorktimePool(
+    int(os.getenv("IVMS_WORKTIME_PROCESSES", "0")),
+    min_rows=int(os.getenv("IVMS_WORKTIME_PARALLEL_MIN_ROWS", "200000")),
+)
+
+
+def worktime_report(filters: Dict[str, str], employee_ids: Optional[List[str]] = None,
+                    source: Optional[Tuple[str, str]] = None) -> List[Dict[str, Any]]:
+    if WORKTIME_ROLLUP:
+        rollup.ensure_started()
+        data = rollup.worktime(filters, employee_ids)
+        if data is not None:
+            return data
+    conn_str, table = source or (DB_CONN_STR, TABLE_NAME)
+    if employee_ids is None:
+        return compute_worktime_folds(f for _, f in worktime_pool.folds(conn_str, table, filters))
+    rows = db.iter_worktime_rows(conn_str, table, filters, employee_ids=employee_ids)
+    return compute_worktime_stream(rows)
+
+
+live.worktime_source = worktime_report
+
+
+_service_started = False
+
+
+def start_service() -> None:
+    """
+    Setup only the serving process does: log files, the live tail, saving
+    presence at exit. Not done at import: parallel.py's worker processes are
+    spawned and re-import the main script, and must not repeat any of it.
+    """
+    global _service_started
+    if _service_started:  # main() with IVMS_SERVER=asgi, then asgi.py at import
+        return
+    _service_started = True
+    if not logger.handlers:
+        # file (rotating)
+        file_handler = RotatingFileHandler(
+            LOG_FILE,
+            maxBytes=5 * 1024 * 1024,  # 5 MB
+            backupCount=5,
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(_formatter)
+        logger.addHandler(file_handler)
+
+        # console (useful for manual запуск)
+        console = logging.StreamHandler()
+        console.setFormatter(_formatter)
+        logger.addHandler(console)
+
+        logger.info("=== iVMS access log service starting ===")
+
+    live.tail = make_tail(LIVE_TAIL, DB_CONN_STR, TABLE_NAME, LIVE_MIN_SECONDS, LIVE_MAX_SECONDS)
+    atexit.register(presence.save)
+
+
+def ensure_live() -> None:
+    if PEOPLE_INDEX:
+        people.ensure_started()
+    if NORMALIZE:
+        normalizer.ensure_started()
+    if MIRROR:
+        mirror.ensure_started()
+    if OCCUPANCY:
+        occupancy.ensure_started()
+    presence.ensure_ready()
+    live.ensure_started(start_serial=presence.last_serial)
+
+
+@app.before_request
+def start_timer():
+    g.t0 = time.perf_counter()
+
+
+@app.after_request
+def record_request(resp):
+    # streamed bodies (SSE, CSV export) are timed up to the response headers
+    t0 = g.pop("t0", None)
+    if t0 is not None:
+        metrics.HTTP_REQUEST.observe(time.perf_counter() - t0, request.endpoint or "other",
+                                     request.method, str(resp.status_code))
+    return resp
+
+
+@app.errorhandler(db.FilterError)
+def handle_filter_error(e):
+    return jsonify({"ok": False, "error": str(e)}), 400
 
 
 @app.errorhandler(Exception)
@@ -81,60 +260,305 @@ def api_doors():
     return jsonify(db.get_doors(DB_CONN_STR, TABLE_NAME))
 
 
+def high_water_serial() -> int:
+    # the live feed already knows it (once presence has the batch: the
+    # summary is served from there); otherwise one MAX(serialNo) seek
+    if live.started:
+        return live.listened_serial
+    return db.get_max_serialno(DB_CONN_STR, TABLE_NAME)
+
+
+def read_source() -> Tuple[str, str, int]:
+    """(conn_str, table, high-water serialNo) for history reads: the mirror when it is close enough."""
+    hw = high_water_serial()
+    if MIRROR:
+        mirror.ensure_started()
+        if mirror.serves(hw):
+            return mirror.conn_str, mirror.table, mirror.hi
+    return DB_CONN_STR, TABLE_NAME, hw
+
+
+def history_source() -> Tuple[str, str]:
+    # the source cached_json keyed the response on, so body and ETag agree
+    src = g.get("source")
+    return src if src is not None else read_source()[:2]
+
+
+def cached_json(fn):
+    """
+    Cache the JSON body by (path, normalized query, high-water serialNo) and
+    answer If-None-Match with 304 before doing any work.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        query = tuple(sorted((k, v) for k, v in request.args.items() if v))
+        conn_str, table, hw = read_source()
+        g.source = (conn_str, table)
+        key = (request.path, query, hw)
+        etag = make_etag(key)
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            body = response_cache.get(key)
+            if body is None:
+                resp = fn(*args, **kwargs)
+                if resp.status_code != 200:
+                    return resp
+                body = resp.get_data()
+                response_cache.put(key, body)
+            resp = Response(body, mimetype="application/json")
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "no-cache"  # always revalidate
+        return resp
+
+    return wrapper
+
+
+def columnar(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """[{...}, ...] -> {"cols": [...], "rows": [[...], ...]}: keys once, not per row."""
+    cols = list(rows[0]) if rows else []
+    return {"cols": cols, "rows": [[r.get(c) for c in cols] for r in rows]}
+
+
 @app.route("/api/log")
+@cached_json
 def api_log():
     filters: Dict[str, str] = dict(request.args)
-    data = db.get_log(DB_CONN_STR, TABLE_NAME, filters, limit=MAX_PAGE_ROWS)
-    return jsonify(data)
+    before = (filters.pop("beforeSerial", None) or "").strip()
+    try:
+        before_serial = int(before) if before else None
+    except ValueError:
+        raise db.FilterError(f"bad beforeSerial: {before!r}, expected a serialNo")
+    as_columns = filters.pop("shape", "") == "columnar"
+
+    # one extra row tells us whether there is a next page
+    conn_str, table = history_source()
+    cols, rows = db.get_log_columns(conn_str, table, filters, limit=MAX_PAGE_ROWS + 1,
+                                    before_serial=before_serial)
+    next_cursor = None
+    if len(rows) > MAX_PAGE_ROWS:
+        rows = rows[:MAX_PAGE_ROWS]
+        next_cursor = int(rows[-1][cols.index("serialNo")])
+    if as_columns:
+        return jsonify({"cols": cols, "rows": rows, "nextCursor": next_cursor})
+    return jsonify({"rows": [dict(zip(cols, r)) for r in rows], "nextCursor": next_cursor})
 
 
 @app.route("/api/summary")
+@cached_json
 def api_summary():
     filters: Dict[str, str] = dict(request.args)
-    events = db.get_log(DB_CONN_STR, TABLE_NAME, filters, limit=2000)
-    return jsonify(compute_summary(events))
+    as_columns = filters.pop("shape", "") == "columnar"
+    ensure_live()
+    data = presence.summary(filters)
+    if data is None:
+        events = db.get_last_by_employee(*history_source(), filters)
+        data = compute_summary(events)
+    return jsonify(columnar(data) if as_columns else data)
 
 
 @app.route("/api/worktime")
+@cached_json
 def api_worktime():
     filters: Dict[str, str] = dict(request.args)
-    events = db.get_log(DB_CONN_STR, TABLE_NAME, filters, limit=10000)
-    return jsonify(compute_worktime(events))
+    as_columns = filters.pop("shape", "") == "columnar"
+    data = worktime_report(filters, source=history_source())
+    return jsonify(columnar(data) if as_columns else data)
+
+
+def csv_response(name: str, header: List[str], rows, gz: bool) -> Response:
+    filename = f"{name}_{datetime.now():%Y%m%d_%H%M%S}.csv" + (".gz" if gz else "")
+    resp = Response(csv_chunks(header, rows, gzip=gz),
+                    mimetype="application/gzip" if gz else "text/csv; charset=utf-8")
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    resp.headers["X-Accel-Buffering"] = "no"  # reverse proxies: pass chunks through
+    return resp
+
+
+@app.route("/api/export/log")
+def api_export_log():
+    filters: Dict[str, str] = dict(request.args)
+    gz = filters.pop("gzip", "") == "1"
+    rows = db.iter_log_rows(*history_source(), filters)
+    return csv_response("log", list(db.LOG_COLUMNS), rows, gz)
+
+
+@app.route("/api/export/worktime")
+def api_export_worktime():
+    """Worktime per employee (or per employee and day with byDay=1), in employeeID order."""
+    filters: Dict[str, str] = dict(request.args)
+    gz = filters.pop("gzip", "") == "1"
+    by_day = filters.pop("byDay", "") == "1"
+    # bad filters raise here, before the response starts
+    folds = worktime_pool.folds(*history_source(), filters, by_day=by_day)
+
+    header = ["employeeID", "personName", "cardNo", "firstIn", "lastOut", "totalInside", "totalSeconds"]
+    if by_day:
+        header.insert(3, "day")
+
+    def rows():
+        for day, f in folds:
+            r = f.result()
+            out = [r["employeeID"], r["personName"], r["cardNo"], r["firstIn"], r["lastOut"],
+                   r["totalInside"], int(f.total.total_seconds())]
+            if by_day:
+                out.insert(3, day.isoformat())
+            yield out
+
+    return csv_response("worktime", header, rows(), gz)
+
+
+@app.route("/api/pool")
+def api_pool():
+    return jsonify(db.pool_stats())
+
+
+@app.route("/api/cache")
+def api_cache():
+    return jsonify(response_cache.stats())
+
+
+@app.route("/api/people")
+def api_people():
+    return jsonify(people.stats())
+
+
+@app.route("/api/normalize")
+def api_normalize():
+    return jsonify(normalizer.stats())
+
+
+@app.route("/api/occupancy")
+def api_occupancy():
+    """
+    Entries, exits and people inside per `step` minutes (15 by default) over
+    dateFrom..dateTo (last 7 days by default), for `door` or all doors;
+    byDoor=1 adds the per-door series.
+    """
+    if not OCCUPANCY:
+        return jsonify({"ok": False, "error": "occupancy store is off (IVMS_OCCUPANCY=0)"}), 404
+    occupancy.ensure_started()
+    today = date.today()
+    a = request.args
+    last = min(db.parse_date(a["dateTo"], "dateTo"), today) if a.get("dateTo") else today
+    # min(): 0001-01-01 minus 6 days would overflow
+    first = (db.parse_date(a["dateFrom"], "dateFrom") if a.get("dateFrom")
+             else last - timedelta(days=min(6, last.toordinal() - 1)))
+    step = (a.get("step") or "15").strip()
+    try:
+        step_minutes = int(step)
+    except ValueError:
+        raise db.FilterError(f"bad step: {step!r}, expected minutes")
+    data = occupancy.series(first, last, door=a.get("door") or None, step_minutes=step_minutes,
+                            by_door=a.get("byDoor") == "1")
+    return jsonify(data)
+
+
+@app.route("/api/occupancy/stats")
+def api_occupancy_stats():
+    return jsonify(occupancy.stats())
+
+
+@app.route("/api/parallel")
+def api_parallel():
+    return jsonify(worktime_pool.stats())
+
+
+@app.route("/api/mirror")
+def api_mirror():
+    return jsonify(mirror.stats(high_water_serial()))
+
+
+@app.route("/api/live")
+def api_live():
+    return jsonify({
+        "started": live.started,
+        "lastSerial": live.last_serial,
+        "subscribers": live.subscriber_count,
+        "bufferRows": len(live.buffer),
+        "bufferFloor": live.buffer_floor,
+        "tail": live.tail.stats(),
+    })
+
+
+def live_lag() -> Optional[int]:
+    if not live.started:
+        return None
+    return max(0, db.get_max_serialno(DB_CONN_STR, TABLE_NAME) - live.last_serial)
+
+
+def pool_total(key: str) -> int:
+    return sum(p[key] for p in db.pool_stats()["pools"])
+
+
+metrics.gauge("ivms_sse_clients", "Connected /sse clients.", lambda: live.subscriber_count)
+metrics.gauge("ivms_live_last_serial", "Last serialNo delivered by the live feed.",
+              lambda: live.last_serial if live.started else None)
+metrics.gauge("ivms_live_lag_rows", "Rows in the table the live feed has not delivered yet.", live_lag)
+metrics.gauge("ivms_db_pool_in_use", "DB connections checked out.", lambda: pool_total("inUse"))
+metrics.gauge("ivms_db_pool_idle", "Idle pooled DB connections.", lambda: pool_total("idle"))
+metrics.counter_func("ivms_cache_hits_total", "Response cache hits.", lambda: response_cache.hits)
+metrics.counter_func("ivms_cache_misses_total", "Response cache misses.", lambda: response_cache.misses)
+metrics.gauge("ivms_cache_bytes", "Response cache size.", lambda: response_cache.stats()["bytes"])
+
+
+@app.route("/metrics")
+def api_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+if MIRROR:
+    metrics.gauge("ivms_mirror_lag_rows", "Source rows not yet in the read mirror.",
+                  lambda: mirror.lag_rows(high_water_serial()) if mirror.ready else None)
+    metrics.gauge("ivms_mirror_serving", "1 if history reads go to the read mirror.",
+                  lambda: int(mirror.serves(high_water_serial())))
+
+
+def sse_open(args: Dict[str, str], last_event_id: Optional[str] = None) -> Tuple[Subscriber, List[str]]:
+    """
+    Subscribe a live client; returns it with the messages to send first. A
+    reconnect (Last-Event-ID, or ?lastEventId=) first gets the rows it missed.
+    """
+    filters: Dict[str, str] = dict(args)
+    last_event_id = (last_event_id or filters.pop("lastEventId", None) or "").strip()
+    try:
+        after_serial = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise db.FilterError(f"bad lastEventId: {last_event_id!r}, expected a serialNo")
+    ensure_live()
+    sub = live.subscribe(filters)
+    serial = sub.start_serial
+    backlog: Optional[List[str]] = []
+    if after_serial is not None:
+        backlog = live.backlog(sub, after_serial, SSE_REPLAY_ROWS)
+    if backlog is None:
+        return sub, [sse_message({"type": "resync", "ts": now_str(), "lastSerial": serial}, id=serial)]
+    # with a backlog its last batch carries the id: the hello must not jump past it
+    hello = sse_message({"type": "hello", "ts": now_str(), "lastSerial": serial, "replayed": bool(backlog)},
+                        id=None if backlog else serial)
+    return sub, [hello] + backlog
+
+
+def sse_ping() -> str:
+    return sse_message({"type": "ping", "ts": now_str()})
 
 
 @app.route("/sse")
 def sse():
-    last_serial = db.get_max_serialno(DB_CONN_STR, TABLE_NAME)
+    sub, first = sse_open(request.args, request.headers.get("Last-Event-ID"))
 
     def gen():
-        yield "data: " + json.dumps(
-            {"type": "hello", "ts": now_str(), "lastSerial": last_serial},
-            ensure_ascii=False
-        ) + "\n\n"
-
-        cur_last = last_serial
-
-        while True:
-            try:
-                rows = db.get_log_after_serial(DB_CONN_STR, TABLE_NAME, cur_last, limit=MAX_SSE_BATCH)
-                if rows:
-                    cur_last = int(rows[-1].get("serialNo", cur_last))
-                    payload = {"type": "batch", "ts": now_str(), "rows": rows}
-                    yield "data: " + json.dumps(payload, ensure_ascii=False) + "\n\n"
-                else:
-                    yield "data: " + json.dumps({"type": "ping", "ts": now_str()}, ensure_ascii=False) + "\n\n"
+        try:
+            yield from first
 
-                time.sleep(SSE_POLL_SECONDS)
-
-            except GeneratorExit:
-                break
-            except Exception as e:
-                logger.exception("SSE error: %s", e)
-                yield "data: " + json.dumps(
-                    {"type": "error", "ts": now_str(), "error": str(e)},
-                    ensure_ascii=False
-                ) + "\n\n"
-                time.sleep(2.0)
+            while True:
+                item = sub.get(timeout=SSE_PING_SECONDS)
+                if item is None:
+                    yield sse_ping()
+                else:
+                    yield item[1]
+        finally:
+            live.unsubscribe(sub)
 
     return Response(gen(), mimetype="text/event-stream")
 
@@ -143,6 +567,14 @@ def main():
     host = os.getenv("IVMS_HOST", "0.0.0.0")
     port = int(os.getenv("IVMS_PORT", "8099"))
     debug = os.getenv("IVMS_DEBUG", "0") == "1"
+    server = os.getenv("IVMS_SERVER", "flask")
+    start_service()
+
+    if server == "asgi":
+        # asyncio SSE + Flask in a thread pool, for hundreds of live clients
+        import asgi
+        asgi.serve(host, port)
+        return
 
     # Для службы reloader НЕЛЬЗЯ
     logger.info("Starting Flask server on %s:%s (debug=%s)", host, port, debug)
@@ -0,0 +1,231 @@
+"""
+asgi.py — production serving mode for many concurrent SSE clients.
+
+/sse is served natively on asyncio: an idle client is a suspended coroutine
+woken by the live feed, not an OS thread sleeping in queue.get(). Every other
+route is the regular Flask app, run in a bounded thread pool.
+
+    pip install uvicorn
+    set IVMS_SERVER=asgi && python app.py
+    # or: uvicorn asgi:application --host 0.0.0.0 --port 8099   (one worker only:
+    #     the live feed and presence state live in the process)
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import db
+
+# `python app.py` runs the app as __main__: importing it again as "app" would
+# build a second app (second feed, duplicate metrics) that nothing serves
+_main = sys.modules.get("__main__")
+if os.path.basename(getattr(_main, "__file__", "") or "") == "app.py":
+    webapp = _main
+else:
+    import app as webapp
+
+logger = logging.getLogger("ivms.asgi")
+
+webapp.start_service()
+
+WSGI_THREADS = int(os.getenv("IVMS_WSGI_THREADS", "32"))
+
+_pool = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="ivms-wsgi")
+_END = object()
+
+
+def _headers(scope: Dict[str, Any]) -> Dict[str, str]:
+    return {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers") or []}
+
+
+async def _watch_disconnect(receive: Callable, gone: asyncio.Event) -> None:
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            gone.set()
+            return
+
+
+async def _send_json(send: Callable, status: int, payload: Dict[str, Any]) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+# ===== /sse on asyncio =====
+
+async def _sse(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    loop = asyncio.get_running_loop()
+    args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    try:
+        # first call may bootstrap presence / start the feed — keep it off the loop
+        sub, first = await loop.run_in_executor(_pool, webapp.sse_open, args,
+                                                _headers(scope).get("last-event-id"))
+    except db.FilterError as e:
+        await _send_json(send, 400, {"ok": False, "error": str(e)})
+        return
+    except Exception as e:
+        webapp.logger.exception("Unhandled exception: %s", e)
+        await _send_json(send, 500, {"ok": False, "error": "Internal Server Error"})
+        return
+
+    wake = asyncio.Event()
+    gone = asyncio.Event()
+    sub.notify = lambda: loop.call_soon_threadsafe(wake.set)
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, gone))
+
+    async def out(msg: str) -> None:
+        await send({"type": "http.response.body", "body": msg.encode("utf-8"), "more_body": True})
+
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+        ]})
+        for msg in first:
+            await out(msg)
+
+        while not gone.is_set():
+            item = sub.get_nowait()
+            if item is not None:
+                await out(item[1])
+                continue
+            wake.clear()
+            item = sub.get_nowait()  # put() may have run before clear()
+            if item is not None:
+                await out(item[1])
+                continue
+            waiter = asyncio.ensure_future(wake.wait())
+            done, _ = await asyncio.wait({waiter, watcher}, timeout=webapp.SSE_PING_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if not done:
+                await out(webapp.sse_ping())
+    finally:
+        sub.notify = None
+        webapp.live.unsubscribe(sub)
+        watcher.cancel()
+
+
+# ===== everything else: Flask in a thread pool =====
+
+def _environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    env: Dict[str, Any] = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in _headers(scope).items():
+        if name == "content-type":
+            env["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            env["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            env[key] = env[key] + "," + value if key in env else value
+    return env
+
+
+async def _wsgi(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    loop = asyncio.get_running_loop()
+
+    chunks: List[bytes] = []
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            return
+        chunks.append(msg.get("body", b""))
+        if not msg.get("more_body"):
+            break
+
+    started: List[Tuple[str, List[Tuple[str, str]]]] = []
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Optional[Any] = None):
+        started[:] = [(status, headers)]
+        return None
+
+    result = await loop.run_in_executor(_pool, webapp.app, _environ(scope, b"".join(chunks)), start_response)
+    gone = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, gone))
+    it = iter(result)
+    sent_head = False
+
+    async def head() -> None:
+        status, headers = started[0]
+        await send({"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                    "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+
+    try:
+        # iterate in the pool too: streaming responses (exports) pull from the DB
+        while not gone.is_set():
+            chunk = await loop.run_in_executor(_pool, next, it, _END)
+            if chunk is _END:
+                break
+            if not sent_head:
+                await head()
+                sent_head = True
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not gone.is_set():
+            if not sent_head:
+                await head()
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        watcher.cancel()
+        close = getattr(result, "close", None)
+        if close is not None:
+            await loop.run_in_executor(_pool, close)
+
+
+async def application(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    if scope["type"] == "lifespan":
+        while True:
+            msg = await receive()
+            if msg["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif msg["type"] == "lifespan.shutdown":
+                webapp.presence.save()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/sse":
+        await _sse(scope, receive, send)
+    else:
+        await _wsgi(scope, receive, send)
+
+
+def serve(host: str, port: int) -> None:
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("IVMS_SERVER=asgi needs uvicorn: pip install uvicorn")
+    logger.info("Starting ASGI server on %s:%s (%s WSGI threads)", host, port, WSGI_THREADS)
+    uvicorn.run(application, host=host, port=port, workers=1, log_level="warning")
+
+
+if __name__ == "__main__":
+    serve(os.getenv("IVMS_HOST", "0.0.0.0"), int(os.getenv("IVMS_PORT", "8099")))
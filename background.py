@@ -0,0 +1,30 @@
+"""
+background.py — the loop of the local stores that follow the source table.
+
+The read mirror (mirror.py) and the occupancy store (occupancy.py) both copy
+new rows in batches on their own thread: full batches mean a backfill and
+the next one follows at once; otherwise the thread sleeps until the live
+feed reports new rows.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Callable
+
+
+def run_woken(step: Callable[[], int], batch: int, wake: threading.Event, log: logging.Logger, what: str,
+              idle_seconds: float = 30.0, error_seconds: float = 5.0) -> None:
+    """Call step() (rows handled) forever; `wake` is set by a live feed listener."""
+    while True:
+        try:
+            if step() >= batch:
+                continue  # backfill: keep going
+        except Exception as e:
+            log.exception("%s error: %s", what, e)
+            time.sleep(error_seconds)
+        # the timeout covers a feed that is not running
+        wake.wait(idle_seconds)
+        wake.clear()
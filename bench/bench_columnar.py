@@ -0,0 +1,84 @@
+"""
+Micro-benchmark for the /api/log response body: dict rows vs columnar.
+
+Converts synthetic pyodbc-shaped tuples (db.LOG_COLUMNS order, datetimes,
+part of the text as iVMS mojibake) and JSON-encodes them the way Flask's
+jsonify does (sorted keys, compact). "dicts" is db.row_to_dict per row;
+"columnar" is db.row_converter plus {"cols", "rows"}.
+
+    python bench/bench_columnar.py [rows]
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_mojibake import make_rows  # noqa: E402
+from db import LOG_COLUMNS, row_converter, row_to_dict  # noqa: E402
+
+
+def make_tuples(n, seed=1):
+    rnd = random.Random(seed)
+    base = datetime(2026, 1, 1, 8)
+    out = []
+    for i, r in enumerate(make_rows(n, seed)):
+        v = {
+            "serialNo": 1_000_000 + i,
+            "authDateTime": base + timedelta(seconds=37 * i),
+            "direction": rnd.choice(("vhod", "vihod", "Вход", "Выход")),
+            "employeeID": str(rnd.randrange(3000)),
+            "cardNo": str(rnd.randrange(10**9)),
+            "deviceSN": "DS-K1T" + str(rnd.randrange(100)),
+        }
+        v.update(r)
+        out.append(tuple(v[c] for c in LOG_COLUMNS))
+    return out
+
+
+def encode(payload):
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def run_dicts(rows):
+    t0 = time.perf_counter()
+    cols = list(LOG_COLUMNS)
+    body = encode({"rows": [row_to_dict(cols, r) for r in rows], "nextCursor": None})
+    return time.perf_counter() - t0, body
+
+
+def run_columnar(rows):
+    t0 = time.perf_counter()
+    convert = row_converter(LOG_COLUMNS)
+    body = encode({"cols": list(LOG_COLUMNS), "rows": [convert(r) for r in rows], "nextCursor": None})
+    return time.perf_counter() - t0, body
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    rows = make_tuples(n)
+    run_dicts(rows[:100])  # warm the text-repair cache for both runs alike
+
+    t_dicts, b_dicts = min((run_dicts(rows) for _ in range(5)), key=lambda x: x[0])
+    t_cols, b_cols = min((run_columnar(rows) for _ in range(5)), key=lambda x: x[0])
+
+    back = json.loads(b_cols)
+    assert [dict(zip(back["cols"], r)) for r in back["rows"]] == json.loads(b_dicts)["rows"]
+
+    print(json.dumps({
+        "rows": n,
+        "dicts_ms": round(t_dicts * 1000, 1),
+        "columnar_ms": round(t_cols * 1000, 1),
+        "speedup": round(t_dicts / t_cols, 2),
+        "dicts_bytes": len(b_dicts),
+        "columnar_bytes": len(b_cols),
+        "size_ratio": round(len(b_cols) / len(b_dicts), 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark for utils.fix_hik_text on the row-conversion hot path.
+
+Builds a synthetic batch shaped like attlog (a few dozen doors, a few
+thousand people, part of them stored as iVMS mojibake) and repairs the four
+text columns that db.row_to_dict touches. "before" is the original
+uncached implementation, kept here verbatim as the baseline.
+
+    python bench/bench_mojibake.py [rows]
+"""
+
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import fix_cache_info, fix_hik_text, to_hik_mojibake  # noqa: E402
+
+TEXT_COLS = ("deviceName", "personName", "doorName", "readerName")
+
+# ===== baseline: fix_hik_text before memoization =====
+
+_MARKERS = (
+    "Рџ", "РЎ", "Р°", "Рµ", "Рё", "РЅ", "Рѕ", "Рї",
+    "СЂ", "СЃ", "С‚", "Сѓ", "С…", "СЏ", "СЌ", "СЋ", "СЊ"
+)
+
+
+def legacy_is_mojibake_ru(s):
+    if not s:
+        return False
+    if any(m in s for m in _MARKERS):
+        return True
+    rs = s.count("Р") + s.count("С")
+    return rs >= 3 and rs / max(1, len(s)) > 0.12
+
+
+def legacy_fix_hik_text(s):
+    if not isinstance(s, str) or not s:
+        return s
+    candidates = [s]
+    if legacy_is_mojibake_ru(s):
+        try:
+            candidates.append(s.encode("cp1251", errors="strict").decode("utf-8", errors="strict"))
+        except Exception:
+            try:
+                candidates.append(s.encode("cp1251", errors="ignore").decode("utf-8", errors="ignore"))
+            except Exception:
+                pass
+    if any(ch in s for ch in ("»", "µ", "¶", "°", "¬", "¦")):
+        try:
+            candidates.append(s.encode("latin-1", errors="ignore").decode("cp1251", errors="ignore"))
+        except Exception:
+            pass
+
+    def score(c):
+        moj = 1 if legacy_is_mojibake_ru(c) else 0
+        rus = len(re.findall(r"[А-Яа-яЁё]", c))
+        penalty = (c.count("Р") + c.count("С"))
+        return (moj, -rus, penalty)
+
+    return sorted(candidates, key=score)[0].strip()
+
+
+# ===== synthetic data =====
+
+FIRST = ["Иван", "Пётр", "Анна", "Мария", "Сергей", "Ольга", "Дмитрий", "Елена", "Алексей", "Наталья"]
+LAST = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев", "Козлов", "Новиков"]
+
+
+def make_rows(n, seed=1):
+    rnd = random.Random(seed)
+    doors = [f"Проходная {i}" for i in range(1, 31)] + [f"Gate {i}" for i in range(1, 11)]
+    people = []
+    for i in range(3000):
+        name = f"{rnd.choice(LAST)} {rnd.choice(FIRST)} {i}"
+        people.append(to_hik_mojibake(name) if rnd.random() < 0.7 else name)
+    doors = [to_hik_mojibake(d) if rnd.random() < 0.8 else d for d in doors]
+
+    rows = []
+    for _ in range(n):
+        door = rnd.choice(doors)
+        rows.append({
+            "deviceName": door,
+            "personName": rnd.choice(people),
+            "doorName": door,
+            "readerName": to_hik_mojibake("Считыватель") if rnd.random() < 0.5 else "Reader 1",
+        })
+    return rows
+
+
+def run(fix, rows):
+    t0 = time.perf_counter()
+    out = []
+    for r in rows:
+        d = dict(r)
+        for k in TEXT_COLS:
+            d[k] = fix(d[k])
+        out.append(d)
+    return time.perf_counter() - t0, out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = make_rows(n)
+
+    t_before, out_before = run(legacy_fix_hik_text, rows)
+    t_after, out_after = run(fix_hik_text, rows)
+    assert out_before == out_after, "repaired text differs from the baseline"
+
+    print(json.dumps({
+        "rows": n,
+        "before_rows_per_sec": round(n / t_before),
+        "after_rows_per_sec": round(n / t_after),
+        "speedup": round(t_before / t_after, 1),
+        "cache": fix_cache_info()._asdict(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Live tail benchmark on the SQLite stand-in: delivery latency vs DB round trips.
+
+A writer inserts bursts of events separated by idle spells into a copy of a
+generated database while a LiveFeed tails it; every tail kind runs in its
+own process. "fixed" is the old behaviour (sleep 1 s between polls), "poll"
+is the adaptive backoff, "ct" probes PRAGMA data_version the way the Change
+Tracking tail probes CHANGE_TRACKING_CURRENT_VERSION() on SQL Server.
+
+    python bench/bench_tail.py --db bench/data/attlog_100000.db --bursts 4 --idle 10
+
+Prints one JSON object: latency p50/p99/max (ms) from commit to the
+subscriber queue, polls (get_log_after_serial) and version probes.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from run_bench import percentile  # noqa: E402
+
+KINDS = ("fixed", "poll", "ct")
+
+
+def writer(conn_str: str, table: str, args, committed: Dict[int, float]) -> None:
+    import sqlitedb
+
+    cn = sqlitedb.connect(conn_str)
+    cols = "employeeID, authDateTime, authDate, authTime, direction, deviceName, deviceSN, personName, cardNo, doorName, readerName"
+    sample = cn.cursor().execute(f"SELECT {cols} FROM {table} ORDER BY serialNo DESC LIMIT 200").fetchall()
+    sql = f"INSERT INTO {table} ({cols}) VALUES ({', '.join('?' * 11)})"
+    k = 0
+    for _ in range(args.bursts):
+        time.sleep(args.idle)
+        # a shift change: one event every burst_gap seconds
+        for _ in range(args.burst_rows):
+            t0 = time.perf_counter()
+            cur = cn.cursor()
+            cur.execute(sql, sample[k % len(sample)])  # autocommit
+            committed[cur.lastrowid] = t0
+            k += 1
+            time.sleep(args.burst_gap)
+    time.sleep(args.idle)
+    cn.close()
+
+
+def worker(args) -> Dict[str, Any]:
+    import metrics
+    from feed import LiveFeed
+    from tail import ChangeTrackingTail, PollingTail
+
+    conn_str, table = os.environ["IVMS_DB_CONN_STR"], "attlog"
+    if args.worker == "fixed":
+        tail = PollingTail(1.0, 1.0)
+    elif args.worker == "poll":
+        tail = PollingTail(args.min_seconds, args.max_seconds)
+    else:
+        tail = ChangeTrackingTail(conn_str, args.min_seconds, args.max_seconds)
+    feed = LiveFeed(conn_str, table, batch_size=50, queue_size=10**6, tail=tail)
+    sub = feed.subscribe({})
+    feed.ensure_started()
+
+    committed: Dict[int, float] = {}
+    t = threading.Thread(target=writer, args=(conn_str, table, args, committed), daemon=True)
+    t.start()
+    arrived: Dict[int, float] = {}
+    while t.is_alive() or not sub.queue.empty():
+        item = sub.get(timeout=0.05)
+        if item is None:
+            continue
+        now = time.perf_counter()
+        for line in item[1].splitlines():
+            if line.startswith("data: ") and '"type": "log"' in line:
+                for r in json.loads(line[6:])["rows"]:
+                    arrived[r["serialNo"]] = now
+    latencies: List[float] = [arrived[s] - t0 for s, t0 in committed.items() if s in arrived]
+    out = {
+        "events": len(committed),
+        "delivered": len(latencies),
+        "polls": metrics.DB_PHASE.count("get_log_after_serial", "execute"),
+        "probes": metrics.DB_PHASE.count("tail_version", "execute"),
+    }
+    if latencies:
+        out.update({"p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                    "max_ms": round(max(latencies) * 1000, 1)})
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--db", default=os.path.join(BENCH_DIR, "data", "attlog_100000.db"),
+                    help="generated database (run_bench.py / gen_attlog.py), copied, not modified")
+    ap.add_argument("--kinds", default=",".join(KINDS))
+    ap.add_argument("--bursts", type=int, default=4)
+    ap.add_argument("--burst-rows", type=int, default=40)
+    ap.add_argument("--burst-gap", type=float, default=0.05, help="seconds between events in a burst")
+    ap.add_argument("--idle", type=float, default=10.0, help="seconds without events between bursts")
+    ap.add_argument("--min-seconds", type=float, default=0.25)
+    ap.add_argument("--max-seconds", type=float, default=5.0)
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args)))
+        return
+
+    result: Dict[str, Any] = {"bursts": args.bursts, "burstRows": args.burst_rows, "idle": args.idle,
+                              "minSeconds": args.min_seconds, "maxSeconds": args.max_seconds, "kinds": {}}
+    for kind in args.kinds.split(","):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "attlog.db")
+            shutil.copyfile(args.db, path)
+            env = dict(os.environ, IVMS_DB_CONN_STR="sqlite:///" + path)
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker", kind]
+            for k in ("bursts", "burst_rows", "burst_gap", "idle", "min_seconds", "max_seconds"):
+                cmd += ["--" + k.replace("_", "-"), str(getattr(args, k))]
+            proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True)
+        result["kinds"][kind] = json.loads(proc.stdout.decode("utf-8").strip().splitlines()[-1])
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
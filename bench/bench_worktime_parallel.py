@@ -0,0 +1,84 @@
+"""
+Worktime report time by number of processes, on the SQLite stand-in.
+
+Runs the report the rollup cannot answer (whole table, optionally with
+filters) through parallel.WorktimePool with 1, 2, 4, ... processes. 1 is
+the plain single pass in this process. Every run's result must equal the
+single pass, so the output also proves the merge is deterministic.
+
+    python bench/bench_worktime_parallel.py --size 1000000 --processes 1,2,4,8
+
+Prints one JSON object: seconds (best of --repeat) and speedup over one
+process (the first --processes entry) per case and process count, plus
+the CPU count of the machine.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+
+def run(pool, conn_str: str, filters: Dict[str, str]) -> List[Dict[str, Any]]:
+    from analytics import compute_worktime_folds
+
+    return compute_worktime_folds(f for _, f in pool.folds(conn_str, "attlog", filters))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--size", type=int, default=1_000_000, help="approximate row count (generated once)")
+    ap.add_argument("--db", help="existing generated database instead of --size")
+    ap.add_argument("--data", default=os.path.join(BENCH_DIR, "data"))
+    ap.add_argument("--processes", default=",".join(str(n) for n in (1, 2, 4, 8) if n <= (os.cpu_count() or 1)) or "1")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    from run_bench import ensure_data
+
+    path = args.db or ensure_data(args.data, args.size)
+    os.environ.setdefault("IVMS_DB_POOL_SIZE", "2")
+    import db
+    import sqlitedb
+    from parallel import WorktimePool
+
+    conn_str = sqlitedb.PREFIX + path
+    door = db.get_doors(conn_str, "attlog")[0]
+    cases = {"all": {}, "door": {"door": door}, "morning": {"timeFrom": "07:00", "timeTo": "10:00"}}
+    counts = [int(n) for n in args.processes.split(",")]
+
+    result: Dict[str, Any] = {"db": path, "rows": db.get_max_serialno(conn_str, "attlog"),
+                              "cpus": os.cpu_count(), "cases": {}}
+    pools = {n: WorktimePool(n, min_rows=0) for n in counts}
+    try:
+        for name, filters in cases.items():
+            expected = run(WorktimePool(1), conn_str, filters)
+            out: Dict[str, Any] = {"employees": len(expected)}
+            base = None
+            for n in counts:
+                run(pools[n], conn_str, filters)  # start the workers, warm caches
+                times = []
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    data = run(pools[n], conn_str, filters)
+                    times.append(time.perf_counter() - t0)
+                    if data != expected:
+                        raise SystemExit(f"{name}: {n} process(es) differ from the single pass")
+                best = min(times)
+                base = base or best
+                out[str(n)] = {"seconds": round(best, 3), "speedup": round(base / best, 2)}
+            result["cases"][name] = out
+    finally:
+        for pool in pools.values():
+            pool.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Synthetic attlog data for the SQLite stand-in (sqlitedb.py).
+
+Generates days of access events ending today: a few thousand people on
+day/office/night shifts, so entries and exits pile up in bursts around
+shift changes; lunch breaks, forgotten exits, double swipes, weekends. Most
+names and doors are stored as iVMS mojibake, like the real table.
+
+    python bench/gen_attlog.py --rows 1000000 --out bench/data/attlog_1m.db
+
+The row count is approximate (whole days are generated). Prints one JSON
+object with what was written.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlitedb  # noqa: E402
+from utils import to_hik_mojibake  # noqa: E402
+
+FIRST = ["Иван", "Пётр", "Анна", "Мария", "Сергей", "Ольга", "Дмитрий", "Елена", "Алексей", "Наталья",
+         "Андрей", "Татьяна", "Михаил", "Юлия", "Николай", "Светлана"]
+LAST = ["Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев", "Козлов",
+        "Новиков", "Морозов", "Волков", "Фёдоров", "Орлов", "Зайцев", "Павлов"]
+
+# (start hour, length hours, share of staff)
+SHIFTS = [(8, 9, 0.55), (9, 9, 0.25), (20, 12, 0.12), (8, 12, 0.08)]
+
+COLUMNS = ("serialNo", "employeeID", "authDateTime", "authDate", "authTime", "direction",
+           "deviceName", "deviceSN", "personName", "cardNo", "doorName", "readerName")
+
+
+def make_people(n, rnd):
+    people = []
+    for i in range(n):
+        last, first = rnd.choice(LAST), rnd.choice(FIRST)
+        if first.endswith("а") or first.endswith("я"):
+            last += "а"
+        name = f"{last} {first}"
+        shift = rnd.choices(SHIFTS, weights=[s[2] for s in SHIFTS])[0]
+        people.append({
+            "id": str(1000 + i),
+            "name": to_hik_mojibake(name) if rnd.random() < 0.7 else name,
+            "card": str(rnd.randrange(10**9, 10**10)),
+            "shift": shift,
+            "door": rnd.randrange(4),  # usual entrance
+        })
+    return people
+
+
+def make_doors(n, rnd):
+    doors = []
+    for i in range(n):
+        name = f"Проходная {i + 1}" if i % 4 else f"Главный вход {i // 4 + 1}"
+        doors.append({
+            "name": to_hik_mojibake(name) if rnd.random() < 0.8 else name,
+            "sn": f"DS-K1T{671 + i}M{rnd.randrange(10**6):06d}",
+        })
+    return doors
+
+
+def day_events(day, people, doors, rnd):
+    weekend = day.weekday() >= 5
+    reader_in, reader_out = to_hik_mojibake("Считыватель 1"), to_hik_mojibake("Считыватель 2")
+    for p in people:
+        if rnd.random() > (0.15 if weekend else 0.92):
+            continue
+        start_h, length, _ = p["shift"]
+        t_in = datetime.combine(day, datetime.min.time()) + timedelta(hours=start_h, minutes=rnd.gauss(-8, 7))
+        t_out = t_in + timedelta(hours=length, minutes=rnd.gauss(12, 10))
+        door = doors[p["door"] if rnd.random() < 0.85 else rnd.randrange(len(doors))]
+        ev = [(t_in, "vhod")]
+        if rnd.random() < 0.03:
+            ev.append((t_in + timedelta(seconds=rnd.randrange(3, 40)), "vhod"))  # double swipe
+        if length <= 9 and rnd.random() < 0.5:
+            lunch = t_in + timedelta(hours=4, minutes=rnd.gauss(0, 20))
+            ev.append((lunch, "vihod"))
+            ev.append((lunch + timedelta(minutes=max(10.0, rnd.gauss(45, 10))), "vhod"))
+        if rnd.random() > 0.03:  # 3% forget to swipe out
+            ev.append((t_out, "vihod"))
+        for t, d in ev:
+            yield t, p, door, d, reader_in if d == "vhod" else reader_out
+
+
+def generate(conn_str, table, rows, employees, door_count, seed=1, end=None):
+    """About `rows` events (whole days, the last one being `end`)."""
+    rnd = random.Random(seed)
+    people = make_people(employees, rnd)
+    doors = make_doors(door_count, rnd)
+    per_day = sum(1 for _ in day_events(date(2026, 1, 5), people, doors, random.Random(seed)))  # a Monday
+    days = max(1, int(rows / (per_day * 0.8)) + 1)
+    end = end or date.today()
+
+    sqlitedb.create_schema(conn_str, table)
+    cn = sqlitedb.connect(conn_str)
+    name = table.split(".")[-1]
+    sql = f"INSERT INTO {name} ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+    serial = 0
+    now = datetime.now()
+    cn.execute("BEGIN")
+    for i in range(days):
+        day = end - timedelta(days=days - 1 - i)
+        batch = []
+        # events are written in time order, like the terminals upload them
+        for t, p, door, d, reader in sorted(day_events(day, people, doors, rnd), key=lambda e: e[0]):
+            if t > now:
+                continue
+            serial += 1
+            batch.append((serial, p["id"], t.replace(microsecond=0), t.strftime("%Y-%m-%d"), t.strftime("%H:%M:%S"),
+                          d, door["name"], door["sn"], p["name"], p["card"], door["name"], reader))
+        cn.executemany(sql, batch)
+    cn.execute("COMMIT")
+    cn.execute("ANALYZE")
+    cn.close()
+    return {"rows": serial, "days": days, "employees": employees, "doors": door_count}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--employees", type=int, default=3000)
+    ap.add_argument("--doors", type=int, default=40)
+    ap.add_argument("--table", default="attlog")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", required=True, help="SQLite file to create (must not exist)")
+    args = ap.parse_args()
+    if os.path.exists(args.out):
+        raise SystemExit(f"{args.out} exists")
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+
+    t0 = time.perf_counter()
+    info = generate(sqlitedb.PREFIX + os.path.abspath(args.out), args.table, args.rows,
+                    args.employees, args.doors, args.seed)
+    info.update({"out": args.out, "seconds": round(time.perf_counter() - t0, 1)})
+    print(json.dumps(info, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Endpoint benchmark on the SQLite stand-in, at several data sizes.
+
+For every size a synthetic database is generated once (bench/gen_attlog.py,
+cached in --data) and a fresh process imports the app against it
+(IVMS_DB_CONN_STR=sqlite:///...). The response cache is off, so every
+request reaches the database. Times /api/doors, /api/log, /api/summary and
+/api/worktime through the Flask test client, plus SSE fan-out (one live-feed
+poll delivered to N filtered subscribers).
+
+    python bench/run_bench.py --sizes 100000,1000000 --repeat 20 > bench.json
+
+Output is one JSON object: p50/p99 latency (ms) and rows per second for
+every case and size, so two runs can be diffed to spot regressions.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def percentile(values: List[float], p: float) -> float:
+    s = sorted(values)
+    return s[max(0, math.ceil(p / 100 * len(s)) - 1)]
+
+
+def summarize(times: List[float], rows: int) -> Dict[str, Any]:
+    p50 = percentile(times, 50)
+    return {
+        "p50_ms": round(p50 * 1000, 2),
+        "p99_ms": round(percentile(times, 99) * 1000, 2),
+        "rows": rows,
+        "rows_per_sec": round(rows / p50) if p50 > 0 else None,
+    }
+
+
+# ===== worker: runs inside a process bound to one database =====
+
+def count_rows(payload: Any) -> int:
+    if isinstance(payload, dict):
+        return len(payload.get("rows") or [])
+    return len(payload)
+
+
+def bench_http(client, cases: List[tuple], repeat: int) -> Dict[str, Any]:
+    out = {}
+    for name, url in cases:
+        r = client.get(url)  # warm-up (plans, text-repair cache)
+        if r.status_code != 200:
+            out[name] = {"url": url, "error": r.status_code}
+            continue
+        rows = count_rows(r.get_json())
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            r = client.get(url)
+            r.get_data()
+            times.append(time.perf_counter() - t0)
+        out[name] = dict(summarize(times, rows), url=url)
+    return out
+
+
+def bench_sse(app, clients_list: List[int], replay: int, door: str) -> List[Dict[str, Any]]:
+    from feed import LiveFeed
+
+    top = app.db.get_max_serialno(app.DB_CONN_STR, app.TABLE_NAME)
+    out = []
+    for clients in clients_list:
+        feed = LiveFeed(app.DB_CONN_STR, app.TABLE_NAME, batch_size=app.MAX_SSE_BATCH, queue_size=10**6)
+        subs = []
+        for i in range(clients):
+            if i % 4 == 0:
+                subs.append(feed.subscribe({"door": door}))
+            elif i % 4 == 1:
+                subs.append(feed.subscribe({"search": "Иванов"}))
+            else:
+                subs.append(feed.subscribe({}))
+        feed.last_serial = max(0, top - replay)
+
+        times = []
+        t_all = time.perf_counter()
+        while True:
+            t0 = time.perf_counter()
+            n = feed.poll_once()
+            if not n:
+                break
+            times.append(time.perf_counter() - t0)
+        total = time.perf_counter() - t_all
+        messages = sum(s.queue.qsize() for s in subs)
+        for s in subs:
+            feed.unsubscribe(s)
+        row = {"clients": clients, "rows": replay, "polls": len(times), "messages": messages,
+               "rows_per_sec": round(replay / total) if total > 0 else None,
+               "messages_per_sec": round(messages / total) if total > 0 else None}
+        if times:
+            row.update({"poll_p50_ms": round(percentile(times, 50) * 1000, 2),
+                        "poll_p99_ms": round(percentile(times, 99) * 1000, 2)})
+        out.append(row)
+    return out
+
+
+def worker(args) -> Dict[str, Any]:
+    import logging
+    import app
+
+    app.start_service()
+    logging.getLogger("ivms").setLevel(logging.WARNING)
+    client = app.app.test_client()
+
+    t0 = time.perf_counter()
+    app.people.ensure_started()
+    while app.PEOPLE_INDEX and not app.people.ready and time.perf_counter() - t0 < 300:
+        time.sleep(0.1)
+    app.ensure_live()
+    if app.WORKTIME_ROLLUP:
+        app.rollup.refresh()
+    warmup_s = time.perf_counter() - t0
+
+    today = date.today()
+    week = (today - timedelta(days=6)).isoformat()
+    month = (today - timedelta(days=29)).isoformat()
+    t = today.isoformat()
+    doors = client.get("/api/doors").get_json()
+    door = doors[0] if doors else ""
+
+    cases = [
+        ("doors", "/api/doors"),
+        ("log", "/api/log"),
+        ("log_columnar", "/api/log?shape=columnar"),
+        ("log_door", "/api/log?" + _qs(door=door)),
+        ("log_search", "/api/log?" + _qs(search="Иванов")),
+        ("log_week_time_window", "/api/log?" + _qs(dateFrom=week, dateTo=t, timeFrom="08:00", timeTo="09:00")),
+        ("summary", "/api/summary"),
+        ("summary_week_sql", "/api/summary?" + _qs(dateFrom=week, dateTo=t)),
+        ("worktime_day", "/api/worktime?" + _qs(dateFrom=t, dateTo=t)),
+        ("worktime_week", "/api/worktime?" + _qs(dateFrom=week, dateTo=t)),
+        ("worktime_month", "/api/worktime?" + _qs(dateFrom=month, dateTo=t)),
+        ("worktime_month_search", "/api/worktime?" + _qs(dateFrom=month, dateTo=t, search="Иванов")),
+    ]
+    return {
+        "warmup_s": round(warmup_s, 2),
+        "http": bench_http(client, cases, args.repeat),
+        "sse": bench_sse(app, [int(x) for x in args.sse_clients.split(",")], args.sse_replay, door),
+    }
+
+
+def _qs(**kw) -> str:
+    from urllib.parse import urlencode
+    return urlencode({k: v for k, v in kw.items() if v})
+
+
+# ===== driver =====
+
+def ensure_data(data_dir: str, size: int) -> str:
+    from gen_attlog import generate
+    import sqlitedb
+
+    path = os.path.join(data_dir, f"attlog_{size}.db")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        for p in (tmp, tmp + "-wal", tmp + "-shm"):
+            if os.path.exists(p):
+                os.remove(p)
+        print(f"generating {path} ...", file=sys.stderr)
+        generate(sqlitedb.PREFIX + tmp, "attlog", size, 3000, 40)
+        os.replace(tmp, path)
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default="100000,1000000", help="approximate row counts")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--data", default=os.path.join(BENCH_DIR, "data"), help="generated databases")
+    ap.add_argument("--sse-clients", default="10,100,1000")
+    ap.add_argument("--sse-replay", type=int, default=5000, help="rows pushed through the feed")
+    ap.add_argument("--rollup", action="store_true", help="build and use the worktime rollup")
+    ap.add_argument("--no-people-index", action="store_true", help="search with LIKE only")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args), ensure_ascii=False))
+        return
+
+    result: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "rollup": args.rollup,
+        "peopleIndex": not args.no_people_index,
+        "sizes": [],
+    }
+    for size in [int(x) for x in args.sizes.split(",")]:
+        path = ensure_data(args.data, size)
+        with tempfile.TemporaryDirectory() as state:
+            env = dict(os.environ,
+                       IVMS_DB_CONN_STR="sqlite:///" + os.path.abspath(path),
+                       IVMS_TABLE="attlog",
+                       IVMS_STATE_DIR=state,
+                       IVMS_CACHE_MB="0",
+                       IVMS_WORKTIME_ROLLUP="1" if args.rollup else "0",
+                       IVMS_PEOPLE_INDEX="0" if args.no_people_index else "1")
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker", path,
+                   "--repeat", str(args.repeat), "--sse-clients", args.sse_clients,
+                   "--sse-replay", str(args.sse_replay)]
+            proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True)
+        entry = {"size": size, "db": path}
+        entry.update(json.loads(proc.stdout.decode("utf-8").strip().splitlines()[-1]))
+        result["sizes"].append(entry)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
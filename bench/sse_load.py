@@ -0,0 +1,137 @@
+"""
+SSE load test: hold N idle /sse connections and record the server's memory
+and CPU at each step.
+
+Start the server first (IVMS_SERVER=asgi or the Flask dev server), then:
+
+    python bench/sse_load.py --url http://127.0.0.1:8099 --pid <server pid> --steps 50,100,200,400
+
+Prints one JSON object: for every step the number of connections actually
+open, server RSS (MB), CPU % averaged over the sample window and threads.
+Process stats come from psutil if installed, otherwise from /proc (Linux).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+
+class ProcStats:
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self._ps = None
+        if pid:
+            try:
+                import psutil
+                self._ps = psutil.Process(pid)
+            except ImportError:
+                pass
+
+    def _cpu_seconds(self) -> float:
+        if self._ps is not None:
+            t = self._ps.cpu_times()
+            return t.user + t.system
+        with open(f"/proc/{self.pid}/stat") as f:
+            parts = f.read().rsplit(")", 1)[1].split()
+        return (int(parts[11]) + int(parts[12])) / os.sysconf("SC_CLK_TCK")
+
+    def _rss_threads(self):
+        if self._ps is not None:
+            return self._ps.memory_info().rss, self._ps.num_threads()
+        rss = threads = 0
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+        return rss, threads
+
+    def sample(self, seconds: float) -> Dict[str, Any]:
+        if not self.pid:
+            return {}
+        c0, t0 = self._cpu_seconds(), time.monotonic()
+        time.sleep(seconds)
+        c1, t1 = self._cpu_seconds(), time.monotonic()
+        rss, threads = self._rss_threads()
+        return {
+            "rss_mb": round(rss / 1024 / 1024, 1),
+            "cpu_percent": round(100.0 * (c1 - c0) / (t1 - t0), 1),
+            "threads": threads,
+        }
+
+
+async def hold(host: str, port: int, path: str, opened: List[int], stop: asyncio.Event) -> None:
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        return
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    try:
+        status = await asyncio.wait_for(reader.readline(), timeout=30)
+    except asyncio.TimeoutError:
+        writer.close()
+        return
+    if b" 200 " not in status:
+        writer.close()
+        return
+    opened[0] += 1
+    try:
+        while not stop.is_set():
+            try:
+                if not await asyncio.wait_for(reader.read(65536), timeout=1.0):
+                    break
+            except asyncio.TimeoutError:
+                continue
+    finally:
+        opened[0] -= 1
+        writer.close()
+
+
+async def run(args) -> Dict[str, Any]:
+    u = urlparse(args.url)
+    host, port = u.hostname, u.port or 80
+    path = "/sse" + (f"?{args.query}" if args.query else "")
+    stats = ProcStats(args.pid)
+    loop = asyncio.get_running_loop()
+
+    stop = asyncio.Event()
+    opened = [0]
+    tasks: List[asyncio.Task] = []
+    result = {"url": args.url, "path": path, "baseline": await loop.run_in_executor(None, stats.sample, 1.0),
+              "steps": []}
+
+    for target in [int(x) for x in args.steps.split(",")]:
+        while len(tasks) < target:
+            tasks.append(asyncio.ensure_future(hold(host, port, path, opened, stop)))
+            if len(tasks) % 50 == 0:
+                await asyncio.sleep(0.2)  # don't SYN-flood the listen backlog
+        await asyncio.sleep(args.settle)
+        row = {"target": target, "open": opened[0]}
+        row.update(await loop.run_in_executor(None, stats.sample, args.window))
+        result["steps"].append(row)
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--url", default="http://127.0.0.1:8099")
+    ap.add_argument("--pid", type=int, help="server process id for memory/CPU stats")
+    ap.add_argument("--steps", default="50,100,200,400")
+    ap.add_argument("--query", default="", help="SSE filters, e.g. door=...")
+    ap.add_argument("--settle", type=float, default=3.0, help="seconds after opening a step")
+    ap.add_argument("--window", type=float, default=5.0, help="CPU sample window, seconds")
+    args = ap.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,321 @@
+from __future__ import annotations
+
 import logging
 logger = logging.getLogger("thirdparty.db")
 
-from typing import Any, Dict, List, Tuple
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+try:
+    import pyodbc
+except ImportError:  # only sqlite:/// connection strings work without it
+    pyodbc = None
+
+import metrics
+import sqlitedb
+from utils import try_fix_cp1251_mojibake, normalize_direction, to_hik_mojibake, hik_match_key
+
+# ===== Filters =====
+
+# persisted time-of-day column created by migrate.py (e.g. "authTimeOfDay"),
+# used for time windows that are too long to expand day by day
+TIME_OF_DAY_COLUMN = os.getenv("IVMS_TIME_COLUMN", "")
+MAX_TIME_WINDOW_DAYS = int(os.getenv("IVMS_TIME_WINDOW_DAYS", "190"))
+
+# search text -> employeeIDs (people.PersonDirectory.resolve), or None to use LIKE
+SEARCH_RESOLVER: Optional[Callable[[str], Optional[List[str]]]] = None
+# seconds a live subscription keeps the employeeIDs its search resolved to
+SEARCH_RESOLVE_SECONDS = 60.0
+
+# text match-key side table (normalize.TextNormalizer.coverage): returns
+# (text_table, lo, hi) — serialNos in [lo, hi] have utils.hik_match_key of
+# the columns in TEXT_KEY_COLUMNS there, lo is None when history is
+# complete — or None to always match the source columns
+TEXT_COVERAGE: Optional[Callable[[], Optional[Tuple[str, Optional[int], int]]]] = None
+TEXT_KEY_COLUMNS = {"deviceName": "deviceKey", "personName": "personKey"}
+
+# connection strings of read mirrors (mirror.py): text stored repaired, the
+# filtered text columns also kept as stored by iVMS (repair is lossy for some
+# letters), no computed time column or side table
+MIRRORS: Set[str] = set()
+MIRROR_RAW_COLUMNS = {"deviceName": "deviceNameRaw", "personName": "personNameRaw"}
+
+# seconds before /api/doors looks for new device names
+DOORS_TTL = float(os.getenv("IVMS_DOORS_TTL", "60"))
+
+# rows per fetchmany() for streaming readers
+FETCH_BATCH = int(os.getenv("IVMS_FETCH_BATCH", "5000"))
 
-import pyodbc
+# ===== Connection pool =====
 
-from utils import try_fix_cp1251_mojibake, normalize_direction, to_hik_mojibake
+POOL_SIZE = int(os.getenv("IVMS_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("IVMS_DB_POOL_TIMEOUT", "10"))
+# connections idle longer than this are pinged with SELECT 1 on checkout
+POOL_CHECK_IDLE = float(os.getenv("IVMS_DB_POOL_CHECK_IDLE", "30"))
+
+# queries slower than this (execute + fetch) are logged with SQL and params; 0 = off
+SLOW_QUERY_MS = float(os.getenv("IVMS_SLOW_QUERY_MS", "0"))
+slow_logger = logging.getLogger("ivms.slow")
+
+# driver errors after which a connection is not reused
+DB_ERRORS: Tuple[type, ...] = (sqlite3.Error,) + ((pyodbc.Error,) if pyodbc is not None else ())
 
 def db_connect(conn_str: str) -> pyodbc.Connection:
+    if sqlitedb.is_sqlite(conn_str):
+        return sqlitedb.connect(conn_str)
+    if pyodbc is None:
+        raise RuntimeError("pyodbc is not installed (pip install pyodbc) — needed for SQL Server")
     return pyodbc.connect(conn_str, autocommit=True)
 
+class PoolTimeout(RuntimeError):
+    pass
+
+class TimedCursor:
+    """
+    Cursor proxy: execute/fetch time and row count per query function
+    (metrics.DB_PHASE / DB_ROWS), plus the slow-query log.
+    """
+
+    _OWN = frozenset(("_cur", "_query", "_sql", "_args", "_spent", "_rows", "_open"))
+
+    def __init__(self, cur: Any, query: str):
+        self._cur = cur
+        self._query = query
+        self._sql = ""
+        self._args: Tuple[Any, ...] = ()
+        self._spent = 0.0
+        self._rows = 0
+        self._open = False
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in self._OWN:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cur, name, value)  # e.g. pyodbc's fast_executemany
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cur, name)
+
+    def _timed(self, phase: str, fn: Callable[..., Any], *args: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            dt = time.perf_counter() - t0
+            self._spent += dt
+            metrics.DB_PHASE.observe(dt, self._query, phase)
+
+    def execute(self, sql: str, *args: Any) -> "TimedCursor":
+        self._finish()
+        self._sql, self._args, self._spent, self._rows, self._open = sql, args, 0.0, 0, True
+        self._timed("execute", self._cur.execute, sql, *args)
+        return self
+
+    def executemany(self, sql: str, seq: Any) -> "TimedCursor":
+        self._finish()
+        self._sql, self._args, self._spent, self._rows, self._open = sql, (), 0.0, 0, True
+        self._timed("execute", self._cur.executemany, sql, seq)
+        self._finish()
+        return self
+
+    def fetchone(self) -> Any:
+        r = self._timed("fetch", self._cur.fetchone)
+        self._rows += r is not None
+        self._finish()
+        return r
+
+    def fetchall(self) -> List[Any]:
+        rows = self._timed("fetch", self._cur.fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def fetchmany(self, size: int) -> List[Any]:
+        rows = self._timed("fetch", self._cur.fetchmany, size)
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def close(self) -> None:
+        self._finish()
+        self._cur.close()
+
+    def _finish(self) -> None:
+        if not self._open:
+            return
+        self._open = False
+        metrics.DB_ROWS.inc(self._query, amount=self._rows)
+        if SLOW_QUERY_MS > 0 and self._spent * 1000 >= SLOW_QUERY_MS:
+            slow_logger.warning("Slow query %s: %.0f ms, %s rows\n%s\nparams=%.500r",
+                                self._query, self._spent * 1000, self._rows,
+                                " ".join(self._sql.split()), self._args[0] if self._args else [])
+
+class TimedConnection:
+    """Pooled connection as handed out by connection(): cursors are TimedCursor."""
+
+    def __init__(self, cn: Any, query: str):
+        self._cn = cn
+        self._query = query
+
+    def cursor(self) -> TimedCursor:
+        return TimedCursor(self._cn.cursor(), self._query)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cn, name)
+
+class ConnectionPool:
+    """
+    Thread-safe pool of pyodbc connections for one connection string.
+    At most `size` connections exist at a time; idle ones are reused LIFO.
+    """
+
+    def __init__(self, conn_str: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 check_idle: float = POOL_CHECK_IDLE):
+        self.conn_str = conn_str
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.check_idle = check_idle
+
+        self._idle: List[Tuple[pyodbc.Connection, float]] = []
+        self._open = 0
+        self._cond = threading.Condition()
+
+        self._stats = {
+            "checkouts": 0,
+            "connects": 0,
+            "reconnects": 0,
+            "discarded": 0,
+            "waits": 0,
+            "timeouts": 0,
+        }
+
+    def _healthy(self, cn: pyodbc.Connection) -> bool:
+        try:
+            cur = cn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            return True
+        except DB_ERRORS:
+            return False
+
+    def _close_quietly(self, cn: pyodbc.Connection) -> None:
+        try:
+            cn.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> pyodbc.Connection:
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self._stats["checkouts"] += 1
+            while not self._idle and self._open >= self.size:
+                self._stats["waits"] += 1
+                left = deadline - time.monotonic()
+                if left <= 0 or not self._cond.wait(left):
+                    if not self._idle and self._open >= self.size:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"no free DB connection in {self.timeout:g}s (pool size {self.size})")
+            if self._idle:
+                cn, idle_since = self._idle.pop()
+            else:
+                cn, idle_since = None, 0.0
+            self._open += 1  # slot reserved for the caller
+
+        try:
+            if cn is not None and time.monotonic() - idle_since > self.check_idle and not self._healthy(cn):
+                logger.warning("Pooled DB connection is broken, reconnecting")
+                self._close_quietly(cn)
+                cn = None
+                with self._cond:
+                    self._stats["reconnects"] += 1
+            if cn is None:
+                cn = db_connect(self.conn_str)
+                with self._cond:
+                    self._stats["connects"] += 1
+            return cn
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def release(self, cn: pyodbc.Connection, broken: bool = False) -> None:
+        if broken:
+            self._close_quietly(cn)
+            with self._cond:
+                self._stats["discarded"] += 1
+                self._open -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((cn, time.monotonic()))
+            self._open -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, query: str = "other") -> Iterator[TimedConnection]:
+        t0 = time.perf_counter()
+        cn = self.acquire()
+        metrics.DB_PHASE.observe(time.perf_counter() - t0, query, "connect")
+        broken = False
+        try:
+            yield TimedConnection(cn, query)
+        except DB_ERRORS:
+            # connection state is unknown after a driver error — don't reuse it
+            broken = True
+            raise
+        finally:
+            self.release(cn, broken=broken)
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for cn, _ in idle:
+            self._close_quietly(cn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            d = dict(self._stats)
+            d.update({
+                "size": self.size,
+                "inUse": self._open,
+                "idle": len(self._idle),
+            })
+        return d
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(conn_str: str) -> ConnectionPool:
+    pool = _pools.get(conn_str)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(conn_str)
+            if pool is None:
+                pool = _pools[conn_str] = ConnectionPool(conn_str)
+    return pool
+
+def connection(conn_str: str, query: str = "other"):
+    """
+    `with connection(conn_str, "get_log") as cn:` — pooled connection, always
+    returned; `query` labels its timings in /metrics.
+    """
+    return get_pool(conn_str).connection(query)
+
+def pool_stats() -> Dict[str, Any]:
+    # connection strings contain passwords — report pools by index only
+    return {"pools": [p.stats() for p in list(_pools.values())]}
+
 def row_to_dict(cols: List[str], row: Tuple[Any, ...]) -> Dict[str, Any]:
     d = dict(zip(cols, row))
     for k in ("deviceName", "personName", "doorName", "readerName"):
@@ -21,28 +327,130 @@ def row_to_dict(cols: List[str], row: Tuple[Any, ...]) -> Dict[str, Any]:
         d["authDateTime"] = d["authDateTime"].strftime("%Y-%m-%d %H:%M:%S")
     return d
 
+_TEXT_FIELDS = ("deviceName", "personName", "doorName", "readerName")
+
+def row_converter(cols: Sequence[str]) -> Callable[[Tuple[Any, ...]], List[Any]]:
+    """
+    row_to_dict's conversions for a fixed column list, done by position:
+    a row in, a list out, no per-row dict.
+    """
+    text_idx = [i for i, c in enumerate(cols) if c in _TEXT_FIELDS]
+    dir_idx = cols.index("direction") if "direction" in cols else None
+    dt_idx = cols.index("authDateTime") if "authDateTime" in cols else None
+    fix = try_fix_cp1251_mojibake
+
+    def convert(row: Tuple[Any, ...]) -> List[Any]:
+        out = list(row)
+        for i in text_idx:
+            out[i] = fix(out[i])
+        if dir_idx is not None:
+            out[dir_idx] = normalize_direction(out[dir_idx])
+        if dt_idx is not None and hasattr(out[dt_idx], "strftime"):
+            out[dt_idx] = out[dt_idx].strftime("%Y-%m-%d %H:%M:%S")
+        return out
+
+    return convert
+
 def get_max_serialno(conn_str: str, table: str) -> int:
-    cn = db_connect(conn_str)
-    cur = cn.cursor()
-    cur.execute(f"SELECT ISNULL(MAX(serialNo), 0) FROM {table}")
-    v = cur.fetchone()[0]
-    cn.close()
+    with connection(conn_str, "get_max_serialno") as cn:
+        cur = cn.cursor()
+        cur.execute(f"SELECT ISNULL(MAX(serialNo), 0) FROM {table}")
+        v = cur.fetchone()[0]
     return int(v or 0)
 
-def get_doors(conn_str: str, table: str) -> List[str]:
-    cn = db_connect(conn_str)
-    cur = cn.cursor()
-    cur.execute(f"""
+def _scan_doors(conn_str: str, table: str, after_serial: Optional[int] = None) -> List[str]:
+    sql = f"""
         SELECT DISTINCT deviceName
         FROM {table}
         WHERE deviceName IS NOT NULL AND LTRIM(RTRIM(deviceName)) <> ''
-        ORDER BY deviceName
-    """)
-    rows = [try_fix_cp1251_mojibake(r[0]) for r in cur.fetchall()]
-    cn.close()
+    """
+    params: List[Any] = []
+    if after_serial is not None:
+        sql += " AND serialNo > ?"
+        params.append(int(after_serial))
+    with connection(conn_str, "_scan_doors") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, params)
+        rows = [try_fix_cp1251_mojibake(r[0]) for r in cur.fetchall()]
     return rows
 
-def build_where(filters: Dict[str, str]) -> Tuple[str, List[Any]]:
+def get_people(conn_str: str, table: str,
+               after_serial: Optional[int] = None) -> Tuple[List[Tuple[str, str, str]], int]:
+    """
+    Distinct (employeeID, personName, cardNo) as stored (not repaired), plus
+    the highest serialNo seen. With `after_serial` only newer rows are read.
+    """
+    sql = f"SELECT employeeID, personName, cardNo, MAX(serialNo) FROM {table}"
+    params: List[Any] = []
+    if after_serial is not None:
+        sql += " WHERE serialNo > ?"
+        params.append(int(after_serial))
+    sql += " GROUP BY employeeID, personName, cardNo"
+    top = int(after_serial or 0)
+    people: List[Tuple[str, str, str]] = []
+    with connection(conn_str, "get_people") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, params)
+        for emp, name, card, serial in cur.fetchall():
+            people.append(("" if emp is None else str(emp), name or "", "" if card is None else str(card)))
+            top = max(top, int(serial or 0))
+    return people, top
+
+_doors: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_doors_lock = threading.Lock()
+
+def get_doors(conn_str: str, table: str) -> List[str]:
+    """
+    Repaired door names, cached in-process. The full DISTINCT scan runs once;
+    after DOORS_TTL only rows newer than the last seen serialNo are checked.
+    """
+    key = (conn_str, table)
+    with _doors_lock:
+        c = _doors.get(key)
+        now = time.monotonic()
+        if c is None:
+            top = get_max_serialno(conn_str, table)
+            c = _doors[key] = {"names": set(_scan_doors(conn_str, table)), "lastSerial": top, "checkedAt": now}
+        elif now - c["checkedAt"] >= DOORS_TTL:
+            top = get_max_serialno(conn_str, table)
+            if top > c["lastSerial"]:
+                c["names"].update(_scan_doors(conn_str, table, after_serial=c["lastSerial"]))
+                c["lastSerial"] = top
+            c["checkedAt"] = now
+        return sorted(n for n in c["names"] if n)
+
+class FilterError(ValueError):
+    """Malformed request filter; the API answers 400 with the message."""
+
+def parse_date(s: str, name: str) -> date:
+    try:
+        return datetime.strptime(s, "%Y-%m-%d").date()
+    except ValueError:
+        raise FilterError(f"bad {name}: {s!r}, expected YYYY-MM-DD")
+
+def _parse_time_offset(s: str, name: str, end: bool) -> timedelta:
+    """
+    'HH:MM' / 'HH:MM:SS' -> offset from midnight. For the upper bound the
+    whole last minute (or second) is included, so the result is exclusive.
+    """
+    for fmt, step in (("%H:%M", timedelta(minutes=1)), ("%H:%M:%S", timedelta(seconds=1))):
+        try:
+            t = datetime.strptime(s, fmt)
+        except ValueError:
+            continue
+        off = timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+        return off + step if end else off
+    raise FilterError(f"bad {name}: {s!r}, expected HH:MM")
+
+def _time_str(off: timedelta) -> str:
+    return (datetime.min + off).strftime("%H:%M:%S")
+
+def build_where(filters: Dict[str, str], mirror: bool = False) -> Tuple[str, List[Any]]:
+    """
+    Filters -> WHERE clause. authDateTime is only compared as a bare column
+    against half-open [from, to) ranges, so SQL Server can seek an index on it.
+    With `mirror` the clause is for a mirror.py copy (see MIRRORS).
+    """
     where = []
     params: List[Any] = []
 
@@ -53,82 +461,385 @@ def build_where(filters: Dict[str, str]) -> Tuple[str, List[Any]]:
     door = filters.get("door")
     search = filters.get("search")
 
+    d_from = parse_date(date_from, "dateFrom") if date_from else None
+    d_to = parse_date(date_to, "dateTo") if date_to else None
+    if d_to == date.max:
+        d_to = None  # no upper bound: the day after would overflow
+
+    if d_from:
+        where.append("authDateTime >= ?")
+        params.append(datetime.combine(d_from, dtime.min))
+    if d_to:
+        where.append("authDateTime < ?")
+        params.append(datetime.combine(d_to + timedelta(days=1), dtime.min))
+
+    if time_from or time_to:
+        t_lo = _parse_time_offset(time_from, "timeFrom", end=False) if time_from else timedelta(0)
+        t_hi = _parse_time_offset(time_to, "timeTo", end=True) if time_to else timedelta(days=1)
+        # without dateTo the days run up to today; a dateFrom after today
+        # (device clocks ahead of the server) falls back to the time of day
+        last_day = d_to or date.today()
+        n_days = (last_day - d_from).days + 1 if d_from else 0
+
+        if d_from and d_to and n_days <= 0:
+            where.append("1 = 0")
+        elif d_from and 0 < n_days <= MAX_TIME_WINDOW_DAYS:
+            # one [day+timeFrom, day+timeTo) range per day -> index range seeks
+            ranges = []
+            for i in range(n_days):
+                day = datetime.combine(d_from + timedelta(days=i), dtime.min)
+                ranges.append("(authDateTime >= ? AND authDateTime < ?)")
+                params.extend([day + t_lo, day + t_hi])
+            where.append("(" + " OR ".join(ranges) + ")")
+        else:
+            # open or very long date range: compare the time of day instead
+            # (seekable only with the computed column from migrate.py)
+            col = (not mirror and TIME_OF_DAY_COLUMN) or "CONVERT(time, authDateTime)"
+            if time_from:
+                where.append(f"{col} >= ?")
+                params.append(_time_str(t_lo))
+            if time_to and t_hi < timedelta(days=1):
+                where.append(f"{col} < ?")
+                params.append(_time_str(t_hi))
+
+    coverage = TEXT_COVERAGE() if TEXT_COVERAGE is not None and not mirror else None
+
+    def text_cond(col: str, op: str, value: str) -> str:
+        # stored text is mojibake or clean: outside the side table both variants
+        # of the value are sent, inside it one key (the repair is lossy, "И")
+        def both(c: str) -> str:
+            params.extend([value, to_hik_mojibake(value)])
+            return f"({c} {op} ? OR {c} {op} ?)"
+
+        if coverage is None:
+            return both(MIRROR_RAW_COLUMNS[col] if mirror else col)
+        text_table, lo, hi = coverage
+        params.append(hik_match_key(value))
+        inside = f"serialNo IN (SELECT serialNo FROM {text_table} WHERE {TEXT_KEY_COLUMNS[col]} {op} ?)"
+        if lo is None:
+            params.append(hi)
+            return f"({inside} OR (serialNo > ? AND {both(col)}))"
+        params.extend([hi, lo])
+        return f"({inside} OR ((serialNo > ? OR serialNo < ?) AND {both(col)}))"
+
+    if door and door != "Все":
+        where.append(text_cond("deviceName", "=", door))
+
+    if search:
+        ids = SEARCH_RESOLVER(search) if SEARCH_RESOLVER is not None else None
+        if ids is not None:
+            # seek on employeeID instead of scanning with LIKE '%...%'
+            if ids:
+                where.append("employeeID IN (" + ", ".join("?" * len(ids)) + ")")
+                params.extend(ids)
+            else:
+                where.append("1 = 0")
+        else:
+            s = f"%{search}%"
+            params.extend([s, s])  # cardNo, employeeID — before text_cond adds its own
+            where.append("(cardNo LIKE ? OR employeeID LIKE ? OR " + text_cond("personName", "LIKE", s) + ")")
+
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+    return where_sql, params
+
+FILTER_KEYS = ("dateFrom", "dateTo", "timeFrom", "timeTo", "door", "search")
+
+def build_row_filter(filters: Dict[str, str]) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """
+    In-memory twin of build_where for already converted rows (repaired text,
+    'YYYY-MM-DD HH:MM:SS' timestamps). None means "no filter".
+    """
+    date_from = filters.get("dateFrom")
+    date_to = filters.get("dateTo")
+    time_from = filters.get("timeFrom")
+    time_to = filters.get("timeTo")
+    door = filters.get("door")
+    search = filters.get("search")
+
+    checks: List[Callable[[Dict[str, Any]], bool]] = []
+
+    def ts(r: Dict[str, Any]) -> str:
+        v = r.get("authDateTime")
+        return v.strftime("%Y-%m-%d %H:%M:%S") if hasattr(v, "strftime") else str(v or "")
+
     if date_from:
-        where.append("CAST(authDateTime AS date) >= ?")
-        params.append(date_from)
+        lo_d = parse_date(date_from, "dateFrom").isoformat()
+        checks.append(lambda r: ts(r)[:10] >= lo_d)
     if date_to:
-        where.append("CAST(authDateTime AS date) <= ?")
-        params.append(date_to)
+        hi_d = parse_date(date_to, "dateTo").isoformat()
+        checks.append(lambda r: ts(r)[:10] <= hi_d)
 
     if time_from:
-        where.append("CONVERT(time, authDateTime) >= ?")
-        params.append(f"{time_from}:00")
+        lo_t = _time_str(_parse_time_offset(time_from, "timeFrom", end=False))
+        checks.append(lambda r: ts(r)[11:19] >= lo_t)
     if time_to:
-        where.append("CONVERT(time, authDateTime) <= ?")
-        params.append(f"{time_to}:59")
+        t_hi = _parse_time_offset(time_to, "timeTo", end=True)
+        if t_hi < timedelta(days=1):
+            hi_t = _time_str(t_hi)
+            checks.append(lambda r: ts(r)[11:19] < hi_t)
 
     if door and door != "Все":
-        door_raw = door
-        door_moji = to_hik_mojibake(door)
-        where.append("(deviceName = ? OR deviceName = ?)")
-        params.extend([door_raw, door_moji])
+        doors = {door, try_fix_cp1251_mojibake(door)}
+        checks.append(lambda r: r.get("deviceName") in doors)
 
     if search:
-        s = f"%{search}%"
-        s_moji = f"%{to_hik_mojibake(search)}%"
-        where.append("(personName LIKE ? OR personName LIKE ? OR cardNo LIKE ? OR employeeID LIKE ?)")
-        params.extend([s, s_moji, s, s])
+        checks.append(_search_check(search))
 
-    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
-    return where_sql, params
+    if not checks:
+        return None
+    return lambda r: all(c(r) for c in checks)
+
+def _search_check(search: str) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Row check for `search`, like build_where: the employeeIDs SEARCH_RESOLVER
+    gives (asked again every SEARCH_RESOLVE_SECONDS, subscriptions are long),
+    else a substring test that also tries the search as it reads after the
+    lossy repair ("Иванов" stored as mojibake comes back as "ванов").
+    """
+    needles = {search.casefold(), try_fix_cp1251_mojibake(to_hik_mojibake(search)).casefold()}
+    needles.discard("")
+    resolved: List[Any] = [None, None]  # monotonic time, employeeID set or None
+
+    def text(r: Dict[str, Any]) -> bool:
+        return any(n in str(r.get(k) or "").casefold() for k in ("personName", "cardNo", "employeeID") for n in needles)
+
+    def check(r: Dict[str, Any]) -> bool:
+        if SEARCH_RESOLVER is None:
+            return text(r)
+        now = time.monotonic()
+        if resolved[0] is None or now - resolved[0] > SEARCH_RESOLVE_SECONDS:
+            ids = SEARCH_RESOLVER(search)
+            resolved[:] = [now, None if ids is None else set(ids)]
+        ids = resolved[1]
+        return text(r) if ids is None else str(r.get("employeeID") or "") in ids
+
+    return check
+
+LOG_COLUMNS = ("serialNo", "authDateTime", "direction", "deviceName", "doorName", "readerName",
+               "personName", "employeeID", "cardNo", "deviceSN")
 
-def get_log(conn_str: str, table: str, filters: Dict[str, str], limit: int) -> List[Dict[str, Any]]:
-    where_sql, params = build_where(filters)
+def get_log_columns(conn_str: str, table: str, filters: Dict[str, str], limit: int,
+                    before_serial: Optional[int] = None) -> Tuple[List[str], List[List[Any]]]:
+    """
+    Newest-first page of events as (column names, row lists). `before_serial`
+    is a keyset cursor: the page continues below that serialNo (a seek on the
+    clustered PK, no OFFSET).
+    """
+    where_sql, params = build_where(filters, conn_str in MIRRORS)
+    if before_serial is not None:
+        where_sql = (where_sql + " AND " if where_sql else "WHERE ") + "serialNo < ?"
+        params.append(int(before_serial))
     sql = f"""
-        SELECT TOP {int(limit)}
-            serialNo,
-            employeeID,
-            authDateTime,
-            direction,
-            deviceName,
-            deviceSN,
-            personName,
-            cardNo,
-            doorName,
-            readerName
+        SELECT TOP {int(limit)} {", ".join(LOG_COLUMNS)}
         FROM {table}
         {where_sql}
         ORDER BY serialNo DESC
     """
-    cn = db_connect(conn_str)
-    cur = cn.cursor()
-    cur.execute(sql, params)
-    cols = [c[0] for c in cur.description]
-    data = [row_to_dict(cols, r) for r in cur.fetchall()]
-    cn.close()
+    with connection(conn_str, "get_log_columns") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, params)
+        cols = [c[0] for c in cur.description]
+        raw = cur.fetchall()
+    convert = row_converter(cols)
+    with metrics.DB_PHASE.time("get_log_columns", "convert"):
+        data = [convert(r) for r in raw]
+    return cols, data
+
+def get_log(conn_str: str, table: str, filters: Dict[str, str], limit: int,
+            before_serial: Optional[int] = None) -> List[Dict[str, Any]]:
+    """get_log_columns as a list of dicts."""
+    cols, rows = get_log_columns(conn_str, table, filters, limit, before_serial)
+    return [dict(zip(cols, r)) for r in rows]
+
+def get_last_by_employee(conn_str: str, table: str, filters: Dict[str, str],
+                         after_serial: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Latest event per employee among rows matching `filters` — one row per
+    person, whatever the number of events (see IX_attlog_employeeID_serialNo).
+    With `after_serial` only employees that have newer rows are returned.
+    """
+    where_sql, params = build_where(filters, conn_str in MIRRORS)
+    where_sql = (where_sql + " AND " if where_sql else "WHERE ") + "employeeID IS NOT NULL AND employeeID <> ''"
+    if after_serial is not None:
+        where_sql += " AND serialNo > ?"
+        params.append(int(after_serial))
+    sql = f"""
+        WITH ranked AS (
+            SELECT
+                serialNo,
+                employeeID,
+                authDateTime,
+                direction,
+                deviceName,
+                personName,
+                cardNo,
+                ROW_NUMBER() OVER (PARTITION BY employeeID ORDER BY serialNo DESC) AS rn
+            FROM {table}
+            {where_sql}
+        )
+        SELECT serialNo, employeeID, authDateTime, direction, deviceName, personName, cardNo
+        FROM ranked
+        WHERE rn = 1
+    """
+    with connection(conn_str, "get_last_by_employee") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, params)
+        cols = [c[0] for c in cur.description]
+        raw = cur.fetchall()
+    with metrics.DB_PHASE.time("get_last_by_employee", "convert"):
+        data = [row_to_dict(cols, r) for r in raw]
     return data
 
-def get_log_after_serial(conn_str: str, table: str, last_serial: int, limit: int) -> List[Dict[str, Any]]:
+def get_log_rows_after_serial(conn_str: str, table: str, last_serial: int, limit: int) -> List[List[Any]]:
+    """Up to `limit` rows with serialNo > last_serial, oldest first, as lists in LOG_COLUMNS order."""
     sql = f"""
-        SELECT TOP {int(limit)}
-            serialNo,
-            employeeID,
-            authDateTime,
-            direction,
-            deviceName,
-            deviceSN,
-            personName,
-            cardNo,
-            doorName,
-            readerName
+        SELECT TOP {int(limit)} {", ".join(LOG_COLUMNS)}
         FROM {table}
         WHERE serialNo > ?
         ORDER BY serialNo ASC
     """
-    cn = db_connect(conn_str)
-    cur = cn.cursor()
-    cur.execute(sql, [last_serial])
-    cols = [c[0] for c in cur.description]
-    rows = [row_to_dict(cols, r) for r in cur.fetchall()]
-    cn.close()
+    with connection(conn_str, "get_log_after_serial") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, [last_serial])
+        raw = cur.fetchall()
+    convert = row_converter(LOG_COLUMNS)
+    with metrics.DB_PHASE.time("get_log_after_serial", "convert"):
+        return [convert(r) for r in raw]
+
+def get_log_after_serial(conn_str: str, table: str, last_serial: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    get_log_rows_after_serial as dicts — the live feed's row format (SSE
+    payload, listeners, row filters); its batches are small.
+    """
+    return [dict(zip(LOG_COLUMNS, r)) for r in get_log_rows_after_serial(conn_str, table, last_serial, limit)]
+
+def get_log_between(conn_str: str, table: str, filters: Dict[str, str], after_serial: int, upto_serial: int,
+                    limit: int) -> List[Dict[str, Any]]:
+    """Rows matching `filters` with after_serial < serialNo <= upto_serial, oldest first (SSE replay)."""
+    where_sql, params = build_where(filters, conn_str in MIRRORS)
+    where_sql = (where_sql + " AND " if where_sql else "WHERE ") + "serialNo > ? AND serialNo <= ?"
+    params.extend([int(after_serial), int(upto_serial)])
+    sql = f"""
+        SELECT TOP {int(limit)} {", ".join(LOG_COLUMNS)}
+        FROM {table}
+        {where_sql}
+        ORDER BY serialNo ASC
+    """
+    with connection(conn_str, "get_log_between") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, params)
+        cols = [c[0] for c in cur.description]
+        raw = cur.fetchall()
+    with metrics.DB_PHASE.time("get_log_between", "convert"):
+        rows = [row_to_dict(cols, r) for r in raw]
     return rows
+
+def get_min_serial_since(conn_str: str, table: str, since: datetime) -> Optional[int]:
+    """Lowest serialNo of events at or after `since` (IX_attlog_authDateTime)."""
+    with connection(conn_str, "get_min_serial_since") as cn:
+        cur = cn.cursor()
+        cur.execute(f"SELECT MIN(serialNo) FROM {table} WHERE authDateTime >= ?", [since])
+        r = cur.fetchone()
+    return int(r[0]) if r and r[0] is not None else None
+
+def get_event_dates(conn_str: str, table: str, after_serial: Optional[int] = None) -> List[date]:
+    """Distinct calendar days that have events (only rows after `after_serial` if given)."""
+    sql = f"SELECT DISTINCT CAST(authDateTime AS date) FROM {table} WHERE authDateTime IS NOT NULL"
+    params: List[Any] = []
+    if after_serial is not None:
+        sql += " AND serialNo > ?"
+        params.append(int(after_serial))
+    with connection(conn_str, "get_event_dates") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, params)
+        vals = [r[0] for r in cur.fetchall()]
+    # older ODBC drivers return DATE columns as strings
+    return sorted(date.fromisoformat(str(v)[:10]) for v in vals)
+
+def _stream(conn_str: str, query: str, sql: str, params: List[Any], batch: int) -> Iterator[Tuple[Any, ...]]:
+    """Raw rows of `sql`, fetched `batch` at a time on one pooled connection."""
+    with connection(conn_str, query) as cn:
+        cur = cn.cursor()
+        try:
+            cur.execute(sql, params)
+            while True:
+                chunk = cur.fetchmany(batch)
+                if not chunk:
+                    break
+                yield from chunk
+        finally:
+            cur.close()
+
+def get_employee_counts(conn_str: str, table: str, filters: Dict[str, str],
+                        where: Optional[Tuple[str, List[Any]]] = None) -> List[Tuple[str, int]]:
+    """(employeeID, matching events) in employeeID order — for splitting a worktime read."""
+    where_sql, params = where if where is not None else build_where(filters, conn_str in MIRRORS)
+    where_sql = (where_sql + " AND " if where_sql else "WHERE ") + "employeeID IS NOT NULL AND employeeID <> ''"
+    sql = f"""
+        SELECT employeeID, COUNT(*)
+        FROM {table}
+        {where_sql}
+        GROUP BY employeeID
+        ORDER BY employeeID
+    """
+    with connection(conn_str, "get_employee_counts") as cn:
+        cur = cn.cursor()
+        cur.execute(sql, list(params))
+        return [(r[0], int(r[1])) for r in cur.fetchall()]
+
+# worktime events: what analytics.WorktimeFold reads, by position
+WORKTIME_COLUMNS = ("employeeID", "authDateTime", "direction", "personName", "cardNo")
+
+def iter_worktime_rows(conn_str: str, table: str, filters: Dict[str, str],
+                       employee_ids: Optional[List[str]] = None,
+                       batch: int = FETCH_BATCH,
+                       where: Optional[Tuple[str, List[Any]]] = None,
+                       employee_range: Optional[Tuple[Optional[str], Optional[str]]] = None,
+                       ) -> Iterator[Tuple[Any, ...]]:
+    """
+    All matching events ordered by (employeeID, authDateTime), as tuples in
+    WORKTIME_COLUMNS order (analytics.iter_folds input), read with fetchmany
+    — no row cap and no full result list in memory. authDateTime stays a
+    datetime for the worktime engine. `employee_ids` narrows the
+    read to those employees (keep it well under the 2100 parameter limit),
+    `employee_range` to lo <= employeeID < hi (either end may be None).
+    `where` is a build_where() result to use instead of `filters`.
+    """
+    where_sql, params = where if where is not None else build_where(filters, conn_str in MIRRORS)
+    params = list(params)
+    if employee_ids is not None:
+        ids_sql = "employeeID IN (" + ", ".join("?" * len(employee_ids)) + ")" if employee_ids else "1 = 0"
+        where_sql = (where_sql + " AND " if where_sql else "WHERE ") + ids_sql
+        params.extend(employee_ids)
+    if employee_range is not None:
+        for bound, op in zip(employee_range, (">=", "<")):
+            if bound is not None:
+                where_sql = (where_sql + " AND " if where_sql else "WHERE ") + f"employeeID {op} ?"
+                params.append(bound)
+    sql = f"""
+        SELECT {", ".join(WORKTIME_COLUMNS)}
+        FROM {table}
+        {where_sql}
+        ORDER BY employeeID, authDateTime, serialNo
+    """
+    fix = try_fix_cp1251_mojibake
+    for emp, dt, direction, name, card in _stream(conn_str, "iter_worktime_rows", sql, params, batch):
+        yield emp, dt, direction, fix(name), card
+
+def iter_log_rows(conn_str: str, table: str, filters: Dict[str, str],
+                  batch: int = FETCH_BATCH) -> Iterator[List[Any]]:
+    """
+    Every matching event, oldest first, as lists in LOG_COLUMNS order (see
+    row_converter). For exports: no row cap, constant
+    memory. Filters are checked before this returns (bad input raises here,
+    not halfway through a response).
+    """
+    where_sql, params = build_where(filters, conn_str in MIRRORS)
+    sql = f"""
+        SELECT {", ".join(LOG_COLUMNS)}
+        FROM {table}
+        {where_sql}
+        ORDER BY serialNo ASC
+    """
+    convert = row_converter(LOG_COLUMNS)
+    return (convert(r) for r in _stream(conn_str, "iter_log_rows", sql, params, batch))
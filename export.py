@@ -0,0 +1,50 @@
+"""
+export.py — streaming CSV for /api/export/*.
+
+Rows are written into a small text buffer and handed out in chunks, so the
+first bytes go out as soon as the header is ready and memory does not grow
+with the size of the export. Output is UTF-8 with a BOM (Excel opens
+Cyrillic correctly) and `;` as separator by default (Russian Excel locale).
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import os
+import zlib
+from typing import Any, Iterable, Iterator, Sequence
+
+CSV_DELIMITER = os.getenv("IVMS_CSV_DELIMITER", ";")
+CHUNK_ROWS = 1000
+
+
+def csv_chunks(header: Sequence[str], rows: Iterable[Sequence[Any]], gzip: bool = False,
+               chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """Encoded CSV in chunks of `chunk_rows` rows; gzip-framed if asked."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None  # wbits=31 -> gzip container
+
+    def out(text: str, last: bool = False) -> bytes:
+        data = text.encode("utf-8")
+        if z is None:
+            return data
+        # sync flush: the client gets every chunk right away, not when zlib's buffer fills
+        return z.compress(data) + z.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=CSV_DELIMITER, lineterminator="\r\n")
+    w.writerow(header)
+    yield out("\ufeff" + buf.getvalue())
+    buf.seek(0)
+    buf.truncate()
+
+    n = 0
+    for r in rows:
+        w.writerow(r)
+        n += 1
+        if n == chunk_rows:
+            yield out(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+            n = 0
+    yield out(buf.getvalue(), last=True)
@@ -0,0 +1,349 @@
+"""
+feed.py — shared live tail of attlog for all SSE clients.
+
+One background thread polls `get_log_after_serial` (paced by a tail.Tail:
+adaptive polling, Change Tracking or WAITFOR) and fans every batch out
+to per-client queues, so DB load does not depend on the number of open
+browsers. Client filters are evaluated in memory; each distinct filter set
+is filtered and encoded once and the same string is queued to its clients.
+Clients get typed events (`log`, `presence-delta`, `worktime-delta`) and
+patch their tables instead of reloading them; worktime deltas are computed
+on a thread of their own so a slow report never holds up the poller. Every
+batch carries its last serialNo as the SSE `id:`, so a reconnecting client
+(Last-Event-ID) is sent just what it missed, from the ring buffer or one
+keyset query.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import db
+from analytics import compute_summary
+from tail import PollingTail, Tail
+from utils import now_str
+
+logger = logging.getLogger("ivms.feed")
+
+
+def sse_message(payload: Dict[str, Any], event: Optional[str] = None, id: Optional[int] = None) -> str:
+    head = f"id: {id}\n" if id is not None else ""
+    if event:
+        head += f"event: {event}\n"
+    return head + "data: " + json.dumps(payload, ensure_ascii=False) + "\n\n"
+
+
+def batch_messages(rows: List[Dict[str, Any]], ts: str) -> str:
+    """
+    `log` + `presence-delta` for one batch as a single queued item; the id is
+    on the last event, so a reconnect never sees half a batch as delivered.
+    """
+    serial = int(rows[-1]["serialNo"])
+    return (sse_message({"type": "log", "ts": ts, "rows": rows}, "log")
+            + sse_message({"type": "presence-delta", "ts": ts, "rows": compute_summary(rows)}, "presence-delta", serial))
+
+
+def filter_key(filters: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple((k, filters[k]) for k in db.FILTER_KEYS if filters.get(k))
+
+
+class Subscriber:
+    """Per-client bounded queue of already-encoded SSE messages."""
+
+    def __init__(self, maxsize: int, filters: Optional[Dict[str, str]] = None):
+        self.queue: "queue.Queue[Tuple[int, str]]" = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        # called after every put (from the poller thread); the ASGI server uses
+        # it to wake the client's coroutine instead of blocking a thread on get()
+        self.notify: Optional[Callable[[], None]] = None
+        # clients with equal filters share one filtered + encoded batch
+        self.key = filter_key(filters or {})
+        self.match = db.build_row_filter(dict(self.key))
+        # feed position when subscribed: every later batch goes through the queue
+        self.start_serial = 0
+
+    def put(self, serial: int, msg: str) -> bool:
+        try:
+            self.queue.put_nowait((serial, msg))
+        except queue.Full:
+            return False
+        if self.notify is not None:
+            self.notify()
+        return True
+
+    def resync(self, serial: int) -> None:
+        """Client is too slow: throw away its backlog and tell it to reload."""
+        self.dropped += 1
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.put(serial, sse_message({"type": "resync", "ts": now_str(), "lastSerial": serial}, id=serial))
+
+    def get(self, timeout: float) -> Optional[Tuple[int, str]]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_nowait(self) -> Optional[Tuple[int, str]]:
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class LiveFeed:
+    """
+    Single poller over `serialNo`, a bounded ring buffer of recent rows and
+    fan-out to subscribers. Started lazily on first use.
+    """
+
+    def __init__(
+        self,
+        conn_str: str,
+        table: str,
+        poll_seconds: float = 1.0,
+        batch_size: int = 50,
+        buffer_size: int = 5000,
+        queue_size: int = 200,
+        worktime_delta_seconds: float = 5.0,
+        tail: Optional[Tail] = None,
+    ):
+        self.conn_str = conn_str
+        self.table = table
+        self.poll_seconds = poll_seconds
+        # decides how long to wait after a poll that did not fill a batch
+        self.tail = tail or PollingTail(poll_seconds, poll_seconds)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.worktime_delta_seconds = worktime_delta_seconds
+
+        # worktime_source(filters, employee_ids) -> worktime rows; set by the app
+        self.worktime_source: Optional[Callable[[Dict[str, str], List[str]], List[Dict[str, Any]]]] = None
+        self._work_pending: Dict[Tuple[Tuple[str, str], ...], Set[str]] = {}
+        self._work_sent_at: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._work_wake = threading.Event()
+        self._work_thread: Optional[threading.Thread] = None
+
+        self.buffer: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        self.last_serial = 0
+        # last_serial once every listener has seen its batch (presence among
+        # them): a response keyed on it never predates the key
+        self.listened_serial = 0
+        # the buffer holds every row with serialNo > buffer_floor
+        self.buffer_floor = 0
+
+        self._subs: Set[Subscriber] = set()
+        self._listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    # ----- lifecycle -----
+
+    def ensure_started(self, start_serial: Optional[int] = None) -> None:
+        """Start polling after `start_serial` (default: the current max serialNo)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            if start_serial is None:
+                start_serial = db.get_max_serialno(self.conn_str, self.table)
+            self.last_serial = self.listened_serial = self.buffer_floor = start_serial
+            self._thread = threading.Thread(target=self._run, name="ivms-live-feed", daemon=True)
+            self._thread.start()
+            self._work_thread = threading.Thread(target=self._run_worktime, name="ivms-live-worktime", daemon=True)
+            self._work_thread.start()
+            logger.info("Live feed started at serialNo=%s", self.last_serial)
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def add_listener(self, fn: Callable[[List[Dict[str, Any]]], None]) -> None:
+        """Call `fn(rows)` from the poller thread for every new batch."""
+        self._listeners.append(fn)
+
+    # ----- subscribers -----
+
+    def subscribe(self, filters: Optional[Dict[str, str]] = None) -> Subscriber:
+        """Filters use build_where semantics and are applied to rows in memory."""
+        sub = Subscriber(self.queue_size, filters)
+        with self._lock:
+            sub.start_serial = self.last_serial
+            self._subs.add(sub)
+        return sub
+
+    def backlog(self, sub: Subscriber, after_serial: int, limit: int) -> Optional[List[str]]:
+        """
+        Messages for the rows `sub` missed between `after_serial` (its
+        Last-Event-ID) and its subscription, or None if there are more than
+        `limit` of them and the client should reload instead.
+        """
+        upto = sub.start_serial
+        if after_serial >= upto:
+            return []
+        with self._lock:
+            in_buffer = after_serial >= self.buffer_floor
+            if in_buffer:
+                rows = [r for r in self.buffer if after_serial < r["serialNo"] <= upto]
+        if in_buffer:
+            if sub.match is not None:
+                rows = [r for r in rows if sub.match(r)]
+        else:
+            # the gap is older than the ring buffer: one keyset range query
+            rows = db.get_log_between(self.conn_str, self.table, dict(sub.key), after_serial, upto, limit + 1)
+        if len(rows) > limit:
+            return None
+        ts = now_str()
+        msgs = [batch_messages(rows[i:i + 500], ts) for i in range(0, len(rows), 500)]
+        self._queue_worktime(sub.key, rows)
+        return msgs
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            self._subs.discard(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subs)
+
+    # ----- poller -----
+
+    def _groups(self) -> Dict[Tuple[Tuple[str, str], ...], List[Subscriber]]:
+        with self._lock:
+            return self._groups_locked()
+
+    def _groups_locked(self) -> Dict[Tuple[Tuple[str, str], ...], List[Subscriber]]:
+        groups: Dict[Tuple[Tuple[str, str], ...], List[Subscriber]] = {}
+        for sub in self._subs:
+            groups.setdefault(sub.key, []).append(sub)
+        return groups
+
+    def _queue_worktime(self, key: Tuple[Tuple[str, str], ...], rows: List[Dict[str, Any]]) -> None:
+        if self.worktime_source is None:
+            return
+        emps = {str(r.get("employeeID") or "").strip() for r in rows}
+        emps.discard("")
+        if emps:
+            with self._lock:
+                self._work_pending.setdefault(key, set()).update(emps)
+            self._work_wake.set()
+
+    def _send(self, subs: List[Subscriber], serial: int, msgs: List[str]) -> None:
+        for sub in subs:
+            for msg in msgs:
+                if not sub.put(serial, msg):
+                    sub.resync(serial)
+                    break
+
+    def _publish(self, rows: List[Dict[str, Any]],
+                 groups: Dict[Tuple[Tuple[str, str], ...], List[Subscriber]]) -> None:
+        """
+        Typed events per filter group: `log` (new rows) and `presence-delta`
+        (new last event of the employees in the batch). Worktime of those
+        employees is queued for the next `worktime-delta`.
+        """
+        serial = self.last_serial
+        ts = now_str()
+        for key, subs in groups.items():
+            match = subs[0].match
+            matched = rows if match is None else [r for r in rows if match(r)]
+            if not matched:
+                continue
+            self._send(subs, serial, [batch_messages(matched, ts)])
+            self._queue_worktime(key, matched)
+
+    def _flush_worktime(self) -> None:
+        """At most one worktime query per filter group every worktime_delta_seconds."""
+        if not self._work_pending:
+            return
+        groups = self._groups()
+        now = time.monotonic()
+        for key in list(self._work_pending):
+            subs = groups.get(key)
+            if not subs:
+                with self._lock:
+                    self._work_pending.pop(key, None)
+                self._work_sent_at.pop(key, None)
+                continue
+            if now - self._work_sent_at.get(key, 0.0) < self.worktime_delta_seconds:
+                continue
+            with self._lock:
+                emps = sorted(self._work_pending.pop(key, ()))
+            if not emps:
+                continue
+            self._work_sent_at[key] = now
+            rows: List[Dict[str, Any]] = []
+            try:
+                for i in range(0, len(emps), 500):
+                    rows.extend(self.worktime_source(dict(key), emps[i:i + 500]))
+            except Exception as e:
+                # keep them for the next attempt, one delta period later
+                with self._lock:
+                    self._work_pending.setdefault(key, set()).update(emps)
+                logger.exception("Live worktime error: %s", e)
+                continue
+            self._send(subs, self.last_serial, [
+                sse_message({"type": "worktime-delta", "ts": now_str(), "rows": rows}, "worktime-delta"),
+            ])
+
+    def _broadcast_error(self, err: Exception) -> None:
+        msg = sse_message({"type": "error", "ts": now_str(), "error": str(err)})
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            sub.put(self.last_serial, msg)
+
+    def poll_once(self) -> int:
+        rows = db.get_log_after_serial(self.conn_str, self.table, self.last_serial, limit=self.batch_size)
+        if not rows:
+            return 0
+        # position, buffer and the subscriber snapshot move together: a client
+        # subscribing concurrently gets this batch either queued or as backlog
+        with self._lock:
+            evict = len(self.buffer) + len(rows) - (self.buffer.maxlen or 0)
+            if evict > 0:
+                last_out = self.buffer[evict - 1] if evict <= len(self.buffer) else rows[evict - len(self.buffer) - 1]
+                self.buffer_floor = int(last_out["serialNo"])
+            self.buffer.extend(rows)
+            self.last_serial = int(rows[-1].get("serialNo", self.last_serial))
+            groups = self._groups_locked()
+        for fn in self._listeners:
+            try:
+                fn(rows)
+            except Exception as e:
+                logger.exception("Live feed listener error: %s", e)
+        self.listened_serial = self.last_serial
+        self._publish(rows, groups)
+        return len(rows)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                n = self.poll_once()
+                # full batch: there is more waiting, drain without sleeping
+                if n < self.batch_size:
+                    self.tail.wait(self.last_serial, n)
+            except Exception as e:
+                logger.exception("Live feed error: %s", e)
+                self._broadcast_error(e)
+                time.sleep(2.0)
+
+    def _run_worktime(self) -> None:
+        """Worktime deltas, off the poller thread: woken by new pending employees."""
+        while True:
+            # the timeout picks up groups held back by worktime_delta_seconds
+            self._work_wake.wait(self.worktime_delta_seconds)
+            self._work_wake.clear()
+            try:
+                self._flush_worktime()
+            except Exception as e:
+                logger.exception("Live worktime error: %s", e)
+                time.sleep(2.0)
@@ -0,0 +1,178 @@
+"""
+metrics.py — minimal Prometheus-style metrics (no client library needed).
+
+Histograms and counters are recorded in-process and rendered in the text
+exposition format by `render()` for GET /metrics. Gauges, and counters
+kept by other objects (`counter_func`), are callables evaluated at scrape
+time.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# seconds: 0.5 ms .. 30 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+logger = logging.getLogger("ivms.metrics")
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._data: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            d = self._data.get(label_values)
+            if d is None:
+                d = self._data[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            d[0][i] += 1
+            d[1][0] += value
+
+    def count(self, *label_values: str) -> int:
+        with self._lock:
+            d = self._data.get(label_values)
+            return sum(d[0]) if d is not None else 0
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *label_values)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(c), s[0]) for k, (c, s) in sorted(self._data.items())]
+        for lv, counts, total in items:
+            acc = 0
+            for le, n in zip(self.buckets + (math.inf,), counts):
+                acc += n
+                le_label = 'le="' + _num(le) + '"'
+                out.append(f"{self.name}_bucket{_labels(self.labels, lv, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labels, lv)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labels, lv)} {acc}")
+        return out
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._data: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._data[label_values] = self._data.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._data.items())
+        out.extend(f"{self.name}{_labels(self.labels, lv)} {_num(v)}" for lv, v in items)
+        return out
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Optional[float]]):
+        self.name = name
+        self.doc = doc
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        v = self.fn()
+        if v is None:
+            return []
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_num(v)}"]
+
+
+class CounterFunc(Gauge):
+    """A counter kept elsewhere (e.g. cache hits), read at scrape time."""
+    kind = "counter"
+
+
+_registry: List[object] = []
+
+
+def histogram(name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    m = Histogram(name, doc, labels, buckets)
+    _registry.append(m)
+    return m
+
+
+def counter(name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+    m = Counter(name, doc, labels)
+    _registry.append(m)
+    return m
+
+
+def gauge(name: str, doc: str, fn: Callable[[], Optional[float]]) -> Gauge:
+    m = Gauge(name, doc, fn)
+    _registry.append(m)
+    return m
+
+
+def counter_func(name: str, doc: str, fn: Callable[[], Optional[float]]) -> CounterFunc:
+    m = CounterFunc(name, doc, fn)
+    _registry.append(m)
+    return m
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in list(_registry):
+        try:
+            lines.extend(m.render())
+        except Exception as e:
+            # a broken gauge must not take the whole scrape down, but it must show up
+            logger.warning("Metric %s failed to render: %r", getattr(m, "name", m), e)
+    return "\n".join(lines) + "\n"
+
+
+# ===== shared metrics =====
+
+DB_PHASE = histogram("ivms_db_phase_seconds", "DB time per query function and phase "
+                     "(connect = pool checkout incl. connecting, execute, fetch, convert).",
+                     ("query", "phase"))
+DB_ROWS = counter("ivms_db_rows_total", "Rows fetched per query function.", ("query",))
+HTTP_REQUEST = histogram("ivms_http_request_seconds", "Flask request handling time.",
+                         ("endpoint", "method", "status"))
+JSON_ENCODE = histogram("ivms_json_encode_seconds", "JSON response encoding time.", ("endpoint",))
@@ -0,0 +1,90 @@
+"""
+migrate.py — optional DDL for the attlog table (indexes, computed columns)
+and the repaired-text side table used by normalize.py.
+
+Every step is idempotent (IF NOT EXISTS), so the script can be re-run after
+upgrades. iVMS-4200 keeps writing into the table; nothing here changes
+existing columns.
+
+    python migrate.py            # apply
+    python migrate.py --dry-run  # print the SQL only
+"""
+
+import sys
+from typing import List, Tuple
+
+import db
+
+
+def _index(table: str, name: str, body: str) -> str:
+    return f"""
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}'))
+            CREATE INDEX {name} ON {table} {body};
+    """
+
+
+def migrations(table: str) -> List[Tuple[str, str]]:
+    text = f"{table}_text"
+    return [
+        # date filters in build_where are half-open ranges on the bare column
+        ("IX_attlog_authDateTime", _index(table, "IX_attlog_authDateTime", "(authDateTime)")),
+
+        # time-of-day filters over long/open date ranges: enable with IVMS_TIME_COLUMN=authTimeOfDay
+        ("authTimeOfDay column", f"""
+            IF COL_LENGTH('{table}', 'authTimeOfDay') IS NULL
+                ALTER TABLE {table} ADD authTimeOfDay AS CONVERT(time(3), authDateTime) PERSISTED;
+        """),
+        ("IX_attlog_authTimeOfDay", _index(table, "IX_attlog_authTimeOfDay", "(authTimeOfDay, authDateTime)")),
+
+        # /api/summary: latest row per employee (ROW_NUMBER ... PARTITION BY employeeID)
+        ("IX_attlog_employeeID_serialNo", _index(
+            table, "IX_attlog_employeeID_serialNo",
+            "(employeeID, serialNo DESC) INCLUDE (authDateTime, direction, deviceName, personName, cardNo)",
+        )),
+
+        # /api/worktime streams rows ordered by (employeeID, authDateTime)
+        ("IX_attlog_employeeID_authDateTime", _index(
+            table, "IX_attlog_employeeID_authDateTime",
+            "(employeeID, authDateTime) INCLUDE (direction, personName, cardNo)",
+        )),
+
+        # text match keys, filled by normalize.py (IVMS_NORMALIZE=1): door/search
+        # filters compare one indexed key instead of two mojibake variants
+        (f"{text} table", f"""
+            IF OBJECT_ID('{text}', 'U') IS NULL
+                CREATE TABLE {text} (
+                    serialNo   INT            NOT NULL CONSTRAINT PK_attlog_text PRIMARY KEY CLUSTERED,
+                    deviceKey  NVARCHAR(255)  NULL,
+                    personKey  NVARCHAR(255)  NULL
+                );
+        """),
+        ("IX_attlog_text_deviceKey", _index(text, "IX_attlog_text_deviceKey", "(deviceKey)")),
+        ("IX_attlog_text_personKey", _index(text, "IX_attlog_text_personKey", "(personKey)")),
+
+        # IVMS_LIVE_TAIL=ct: only if a DBA turned Change Tracking on for the database
+        # (ALTER DATABASE ... SET CHANGE_TRACKING = ON (CHANGE_RETENTION = 1 DAYS, AUTO_CLEANUP = ON))
+        ("change tracking", f"""
+            IF EXISTS (SELECT 1 FROM sys.change_tracking_databases WHERE database_id = DB_ID())
+               AND NOT EXISTS (SELECT 1 FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID('{table}'))
+                ALTER TABLE {table} ENABLE CHANGE_TRACKING;
+        """),
+    ]
+
+
+def apply(conn_str: str, table: str, dry_run: bool = False) -> None:
+    for name, sql in migrations(table):
+        if dry_run:
+            print(f"-- {name}\n{sql.strip()}\nGO\n")
+            continue
+        print(f"applying: {name}")
+        with db.connection(conn_str, "migrate") as cn:
+            cn.cursor().execute(sql)
+
+
+def main() -> None:
+    from app import DB_CONN_STR, TABLE_NAME
+    apply(DB_CONN_STR, TABLE_NAME, dry_run="--dry-run" in sys.argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+mirror.py — local SQLite read mirror of attlog for history and reports.
+
+A background job copies rows from the production table into a SQLite file
+(same schema as sqlitedb.SCHEMA) in serialNo order, with deviceName /
+personName / doorName / readerName already repaired and direction
+normalized. deviceName and personName are also kept as stored
+(db.MIRROR_RAW_COLUMNS): the repair is lossy for a few letters (UTF-8 "И"
+is D0 98 and 0x98 is not in cp1251), so filters compare the stored text the
+same way they do on the source. The live feed wakes the job on every new
+batch; the last `recheck_rows` serials are compared with the source for rows committed out
+of order, and every `verify_seconds` the whole range is compared bucket by
+bucket (count and sum of serialNo) and differing buckets are copied again.
+
+Once the mirror has caught up, /api/log, /api/summary, /api/worktime and the
+CSV exports read it through the usual db functions (its connection string is
+in db.MIRRORS, so build_where uses the raw copies and computes the time of
+day from authDateTime), as long as it is
+at most `max_lag` rows behind. The live feed keeps tailing the source.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from background import run_woken
+import db
+import sqlitedb
+from utils import normalize_direction, try_fix_cp1251_mojibake
+
+logger = logging.getLogger("ivms.mirror")
+
+COLUMNS = ("serialNo", "employeeID", "authDateTime", "authDate", "authTime", "direction",
+           "deviceName", "deviceSN", "personName", "cardNo", "doorName", "readerName")
+TEXT_COLUMNS = ("deviceName", "personName", "doorName", "readerName")
+RAW_COLUMNS = tuple(db.MIRROR_RAW_COLUMNS.items())  # (column, raw copy)
+
+_RAW_SOURCE = [COLUMNS.index(c) for c, _ in RAW_COLUMNS]
+
+
+def _clean_row(row: Sequence[Any]) -> Tuple[Any, ...]:
+    out = list(row)
+    for i, c in enumerate(COLUMNS):
+        if c in TEXT_COLUMNS:
+            out[i] = try_fix_cp1251_mojibake(out[i])
+        elif c == "direction":
+            out[i] = normalize_direction(out[i]) or out[i]
+    return tuple(out) + tuple(row[i] for i in _RAW_SOURCE)
+
+
+class Mirror:
+    def __init__(self, conn_str: str, table: str, path: str, batch: int = 5000, max_lag: int = 1000,
+                 recheck_rows: int = 1000, verify_seconds: float = 3600.0, bucket: int = 100000):
+        self.source_conn_str = conn_str
+        self.source_table = table
+        self.path = path
+        self.conn_str = sqlitedb.PREFIX + path
+        self.table = "attlog"
+        self.batch = batch
+        self.max_lag = max_lag
+        self.recheck_rows = recheck_rows
+        self.verify_seconds = verify_seconds
+        self.bucket = bucket
+
+        self.hi = 0  # every source row with serialNo <= hi has been copied
+        self.ready = False  # caught up with the source at least once
+        self.synced_at: Optional[float] = None  # time.time() when last caught up
+        self.copied = 0
+        self.last_verify: Optional[Dict[str, Any]] = None
+        self._verify_due = 0.0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._cn: Any = None  # writer connection, used by the mirror thread only
+
+    # ----- reads -----
+
+    def serves(self, high_water: int) -> bool:
+        """Use the mirror for a read when the source is at `high_water`?"""
+        return self.ready and high_water - self.hi <= self.max_lag
+
+    def lag_rows(self, high_water: int) -> int:
+        return max(0, high_water - self.hi)
+
+    def notify(self, rows: List[Dict[str, Any]]) -> None:
+        """Live feed listener: new source rows exist."""
+        self._wake.set()
+
+    # ----- copying -----
+
+    def _insert(self, rows: List[Tuple[Any, ...]]) -> None:
+        cols = COLUMNS + tuple(raw for _, raw in RAW_COLUMNS)
+        sql = f"INSERT OR REPLACE INTO {self.table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        self._cn.execute("BEGIN")
+        try:
+            self._cn.executemany(sql, [_clean_row(r) for r in rows])
+            self._cn.execute("COMMIT")
+        except Exception:
+            self._cn.execute("ROLLBACK")
+            raise
+        self.copied += len(rows)
+
+    def _fetch_source(self, where: str, params: List[Any], limit: Optional[int] = None) -> List[Tuple[Any, ...]]:
+        top = f"TOP {int(limit)} " if limit else ""
+        sql = f"SELECT {top}{', '.join(COLUMNS)} FROM {self.source_table} WHERE {where} ORDER BY serialNo ASC"
+        with db.connection(self.source_conn_str, "mirror_copy") as cn:
+            cur = cn.cursor()
+            cur.execute(sql, params)
+            return [tuple(r) for r in cur.fetchall()]
+
+    def copy_once(self) -> int:
+        rows = self._fetch_source("serialNo > ?", [self.hi], self.batch)
+        if rows:
+            self._insert(rows)
+            self.hi = int(rows[-1][0])
+        return len(rows)
+
+    def recheck_once(self) -> int:
+        """Copy rows that were committed below `hi` after it had passed them."""
+        lo = max(0, self.hi - self.recheck_rows)
+        with db.connection(self.source_conn_str, "mirror_recheck") as cn:
+            cur = cn.cursor()
+            cur.execute(f"SELECT serialNo FROM {self.source_table} WHERE serialNo > ? AND serialNo <= ?", [lo, self.hi])
+            source = {int(r[0]) for r in cur.fetchall()}
+        have = {int(r[0]) for r in self._cn.execute(
+            f"SELECT serialNo FROM {self.table} WHERE serialNo > ? AND serialNo <= ?", [lo, self.hi]).fetchall()}
+        missing = sorted(source - have)
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            self._insert(self._fetch_source(f"serialNo IN ({', '.join('?' * len(chunk))})", chunk))
+        if missing:
+            logger.info("Mirrored %s late row(s) below serialNo=%s", len(missing), self.hi)
+        return len(missing)
+
+    # ----- consistency -----
+
+    def _buckets(self, cur: Any, table: str) -> Dict[int, Tuple[int, int]]:
+        b = int(self.bucket)
+        cur.execute(f"""
+            SELECT serialNo / {b}, COUNT(*), SUM(CAST(serialNo AS BIGINT))
+            FROM {table}
+            WHERE serialNo <= ?
+            GROUP BY serialNo / {b}
+        """, [self.hi])
+        return {int(k): (int(n), int(s)) for k, n, s in cur.fetchall()}
+
+    def verify(self, repair: bool = True) -> Dict[str, Any]:
+        """
+        Compare row count and serialNo sum per bucket of `bucket` serials up
+        to `hi`; buckets that differ are deleted and copied again.
+        """
+        t0 = time.perf_counter()
+        with db.connection(self.source_conn_str, "mirror_verify") as cn:
+            source = self._buckets(cn.cursor(), self.source_table)
+        mine = self._buckets(self._cn.cursor(), self.table)
+        bad = sorted(k for k in set(source) | set(mine) if source.get(k) != mine.get(k))
+        repaired = 0
+        if repair:
+            for k in bad:
+                lo, hi = k * self.bucket, min((k + 1) * self.bucket - 1, self.hi)
+                self._cn.execute(f"DELETE FROM {self.table} WHERE serialNo >= ? AND serialNo <= ?", [lo, hi])
+                after = lo - 1
+                while True:
+                    rows = self._fetch_source("serialNo > ? AND serialNo <= ?", [after, hi], self.batch)
+                    if not rows:
+                        break
+                    self._insert(rows)
+                    repaired += len(rows)
+                    after = int(rows[-1][0])
+        if bad:
+            logger.warning("Mirror differed from the source in %s bucket(s) of %s serials: %s",
+                           len(bad), self.bucket, bad[:20])
+        result = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "hi": self.hi,
+            "buckets": len(source),
+            "rows": sum(n for n, _ in source.values()),
+            "mismatched": bad,
+            "recopied": repaired,
+            "seconds": round(time.perf_counter() - t0, 2),
+        }
+        self.last_verify = result
+        return result
+
+    # ----- lifecycle -----
+
+    def _create_schema(self) -> None:
+        sqlitedb.create_schema(self.conn_str, self.table)
+        have = {r[1] for r in self._cn.execute(f"PRAGMA table_info({self.table})").fetchall()}
+        for _, raw in RAW_COLUMNS:
+            if raw not in have:
+                self._cn.execute(f"ALTER TABLE {self.table} ADD COLUMN {raw} TEXT")
+            self._cn.execute(f"CREATE INDEX IF NOT EXISTS IX_{self.table}_{raw} ON {self.table}({raw})")
+
+    def ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._cn = sqlitedb.connect(self.conn_str)
+            self._create_schema()
+            self.hi = int(self._cn.execute(f"SELECT IFNULL(MAX(serialNo), 0) FROM {self.table}").fetchone()[0])
+            db.MIRRORS.add(self.conn_str)
+            self._verify_due = time.monotonic() + self.verify_seconds
+            self._thread = threading.Thread(target=run_woken, name="ivms-mirror", daemon=True,
+                                            args=(self.step, self.batch, self._wake, logger, "Mirror"))
+            self._thread.start()
+            logger.info("Mirror %s starting at serialNo=%s", self.path, self.hi)
+
+    def step(self) -> int:
+        """Copy one batch; when caught up, recheck the tail and verify if due."""
+        n = self.copy_once()
+        if n >= self.batch:
+            return n
+        if not self.ready:
+            logger.info("Mirror caught up at serialNo=%s (%s rows copied)", self.hi, self.copied)
+        self.ready = True
+        self.synced_at = time.time()
+        n += self.recheck_once()
+        if self.verify_seconds > 0 and time.monotonic() >= self._verify_due:
+            self._verify_due = time.monotonic() + self.verify_seconds
+            self.verify()
+        return n
+
+    def stats(self, high_water: Optional[int] = None) -> Dict[str, Any]:
+        d = {
+            "path": self.path,
+            "ready": self.ready,
+            "hi": self.hi,
+            "copied": self.copied,
+            "syncedAt": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.synced_at)) if self.synced_at else None,
+            "maxLag": self.max_lag,
+            "lastVerify": self.last_verify,
+        }
+        if high_water is not None:
+            d["lagRows"] = self.lag_rows(high_water)
+        return d
@@ -0,0 +1,167 @@
+"""
+normalize.py — background job that writes text match keys into a side table.
+
+iVMS stores deviceName/personName as cp1251 mojibake — or, depending on the
+device and version, as clean text. Filters on the source columns therefore
+send two variants of every value. The job writes utils.hik_match_key of
+both columns into `<table>_text` (serialNo PK, keys indexed, created by
+migrate.py), so inside its range a filter is one indexed predicate. Keys
+rather than repaired text: the repair is lossy ("И"), the key is not.
+
+New rows are tailed upwards from the highest done serialNo, history is
+backfilled downwards from the lowest. The written serialNos are always one
+contiguous range, so the checkpoint is simply MIN/MAX of the side table and
+the job resumes after a restart without extra state. Outside that range
+db.build_where keeps matching both variants on the source columns.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+from utils import hik_match_key
+
+logger = logging.getLogger("ivms.normalize")
+
+KEY_COLUMNS = tuple(db.TEXT_KEY_COLUMNS.items())  # (source column, key column)
+
+
+class TextNormalizer:
+    def __init__(self, conn_str: str, table: str, text_table: str,
+                 batch: int = 2000, idle_seconds: float = 5.0, recheck_rows: int = 1000):
+        self.conn_str = conn_str
+        self.table = table
+        self.text_table = text_table
+        self.batch = batch
+        self.idle_seconds = idle_seconds
+        # rows committed out of serialNo order can land below the tail; the
+        # last `recheck_rows` serials are re-checked for such holes
+        self.recheck_rows = recheck_rows
+
+        self._lo: Optional[int] = None  # covered range is [lo, hi]
+        self._hi: Optional[int] = None
+        self._first: Optional[int] = None  # MIN(serialNo) of the source table
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+
+    # ----- coverage -----
+
+    def coverage(self) -> Optional[Tuple[str, Optional[int], int]]:
+        """
+        (text_table, lo, hi) for db.TEXT_COVERAGE: rows with lo <= serialNo <= hi
+        are in the side table; lo is None once history is fully backfilled.
+        """
+        with self._lock:
+            if self._hi is None or self._lo is None or self._lo > self._hi:
+                return None
+            done = self._first is not None and self._lo <= self._first
+            return self.text_table, (None if done else self._lo), self._hi
+
+    def _load_bounds(self) -> None:
+        with db.connection(self.conn_str, "normalize_bounds") as cn:
+            cur = cn.cursor()
+            cur.execute(f"SELECT MIN(serialNo), MAX(serialNo) FROM {self.text_table}")
+            lo, hi = cur.fetchone()
+            cur.execute(f"SELECT MIN(serialNo) FROM {self.table}")
+            first = cur.fetchone()[0]
+        if hi is None:
+            # empty side table: start at the current top, tail up and backfill down
+            hi = db.get_max_serialno(self.conn_str, self.table)
+            lo = hi + 1
+        with self._lock:
+            self._lo, self._hi = int(lo), int(hi)
+            self._first = int(first) if first is not None else None
+
+    # ----- copying -----
+
+    def _copy(self, where: str, params: List[Any], order: str) -> List[int]:
+        src = ", ".join(c for c, _ in KEY_COLUMNS)
+        dst = ", ".join(k for _, k in KEY_COLUMNS)
+        sql = f"""
+            SELECT TOP {int(self.batch)} serialNo, {src}
+            FROM {self.table} a
+            WHERE {where}
+            ORDER BY serialNo {order}
+        """
+        with db.connection(self.conn_str, "normalize_copy") as cn:
+            cur = cn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            if not rows:
+                return []
+            data = [(int(r[0]),) + tuple(hik_match_key(v) for v in r[1:]) for r in rows]
+            cur.fast_executemany = True
+            cur.executemany(
+                f"INSERT INTO {self.text_table} (serialNo, {dst}) VALUES (?, {', '.join('?' * len(KEY_COLUMNS))})",
+                data,
+            )
+            cn.commit()
+        self.written += len(data)
+        return [d[0] for d in data]
+
+    def tail_once(self) -> int:
+        done = self._copy("serialNo > ?", [self._hi], "ASC")
+        if done:
+            with self._lock:
+                self._hi = max(done)
+        return len(done)
+
+    def backfill_once(self) -> int:
+        if self._first is None or self._lo <= self._first:
+            return 0
+        done = self._copy("serialNo < ?", [self._lo], "DESC")
+        with self._lock:
+            if done:
+                self._lo = min(done)
+            else:
+                self._first = self._lo  # nothing older left
+        return len(done)
+
+    def recheck_once(self) -> int:
+        lo = max(self._lo, self._hi - self.recheck_rows)
+        where = f"""serialNo >= ? AND serialNo <= ?
+              AND NOT EXISTS (SELECT 1 FROM {self.text_table} t WHERE t.serialNo = a.serialNo)"""
+        n = len(self._copy(where, [lo, self._hi], "ASC"))
+        if n:
+            logger.info("Normalized %s late row(s) below serialNo=%s", n, self._hi)
+        return n
+
+    def step(self) -> int:
+        """One round: tail first (live data), then a backfill batch. Returns rows written."""
+        if self._hi is None:
+            self._load_bounds()
+        n = self.tail_once()
+        if n < self.batch:
+            n += self.recheck_once()
+        return n + self.backfill_once()
+
+    def ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="ivms-normalize", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.step():
+                    continue
+            except Exception as e:
+                logger.exception("Normalization error: %s", e)
+            time.sleep(self.idle_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        cov = self.coverage()
+        return {
+            "textTable": self.text_table,
+            "lo": self._lo,
+            "hi": self._hi,
+            "backfillDone": cov is not None and cov[1] is None,
+            "written": self.written,
+        }
@@ -0,0 +1,305 @@
+"""
+occupancy.py — entries, exits and people inside per 15 minutes and door.
+
+A local SQLite store of one row per (bucket, deviceName) that saw anything:
+entries and exits in the bucket, and `inside` — people inside at the end of
+the bucket who came in through that door (summed over doors: everyone
+inside). The last direction of every employee is kept with it, so an exit
+through another door, or a second entry, moves the person instead of
+double counting; a forgotten exit counts as inside until the person's next
+event, like the summary tab.
+
+The store is updated from new serialNo rows (woken by the live feed, like
+mirror.py), with direction from the same normalize_direction as everything
+else, and only keeps `days` days. A range read is one index range scan plus
+one seek per door for the starting value, so it costs O(buckets), however
+many events there were. Rows that arrive out of time order for a person are
+counted as entries/exits but do not change who is inside.
+"""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from background import run_woken
+import db
+from utils import normalize_direction
+
+logger = logging.getLogger("ivms.occupancy")
+
+BUCKET_MINUTES = 15
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS occupancy (
+    bucket      TEXT    NOT NULL,   -- 'YYYY-MM-DD HH:MM', start of the 15 minutes
+    deviceName  TEXT    NOT NULL,
+    entries     INTEGER NOT NULL,
+    exits       INTEGER NOT NULL,
+    inside      INTEGER NOT NULL,   -- at the end of the bucket
+    PRIMARY KEY (bucket, deviceName)
+);
+CREATE INDEX IF NOT EXISTS ix_occupancy_door ON occupancy(deviceName, bucket);
+CREATE TABLE IF NOT EXISTS person (
+    employeeID  TEXT PRIMARY KEY,
+    lastTime    TEXT NOT NULL,
+    door        TEXT               -- door the person is inside through, NULL when outside
+);
+CREATE TABLE IF NOT EXISTS door (
+    deviceName  TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_FMT = "%Y-%m-%d %H:%M"
+
+# positions in db.LOG_COLUMNS
+_SERIAL, _TS, _DIRECTION, _DOOR, _EMP = (db.LOG_COLUMNS.index(c) for c in
+                                         ("serialNo", "authDateTime", "direction", "deviceName", "employeeID"))
+
+
+def bucket_of(ts: str) -> str:
+    """'YYYY-MM-DD HH:MM:SS' -> start of its bucket, 'YYYY-MM-DD HH:MM'."""
+    m = int(ts[14:16])
+    return f"{ts[:14]}{m - m % BUCKET_MINUTES:02d}"
+
+
+class OccupancyStore:
+    def __init__(self, conn_str: str, table: str, path: str, days: int = 90, batch: int = 5000):
+        self.conn_str = conn_str
+        self.table = table
+        self.path = path
+        self.days = days
+        self.batch = batch
+
+        self.last_serial: Optional[int] = None
+        self.ready = False  # caught up with the table at least once
+        self.applied = 0
+        self._people: Dict[str, Tuple[str, Optional[str]]] = {}  # employeeID -> (lastTime, door)
+        self._doors: set = set()
+        self._pruned: Optional[date] = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._schema = False  # created on first use, not at import of app.py
+
+    def _open(self) -> sqlite3.Connection:
+        cn = sqlite3.connect(self.path, timeout=30)
+        cn.execute("PRAGMA journal_mode=WAL")
+        if not self._schema:
+            cn.executescript(_SCHEMA)
+            self._schema = True
+        return cn
+
+    def cutoff(self) -> datetime:
+        return datetime.combine(date.today() - timedelta(days=self.days - 1), datetime.min.time())
+
+    def notify(self, rows: List[Dict[str, Any]]) -> None:
+        """Live feed listener: new rows exist."""
+        self._wake.set()
+
+    # ----- maintenance -----
+
+    def _load(self, cn: sqlite3.Connection) -> None:
+        r = cn.execute("SELECT value FROM meta WHERE key = 'lastSerial'").fetchone()
+        if r is not None:
+            self.last_serial = int(r[0])
+        else:
+            # first run: start at the retention window
+            first = db.get_min_serial_since(self.conn_str, self.table, self.cutoff())
+            self.last_serial = first - 1 if first is not None else db.get_max_serialno(self.conn_str, self.table)
+        self._people = {e: (t, d) for e, t, d in cn.execute("SELECT employeeID, lastTime, door FROM person")}
+        self._doors = {d for (d,) in cn.execute("SELECT deviceName FROM door")}
+        logger.info("Occupancy store %s: serialNo=%s, %s people inside",
+                    self.path, self.last_serial, sum(1 for _, d in self._people.values() if d is not None))
+
+    def _apply(self, cn: sqlite3.Connection, rows: List[List[Any]]) -> None:
+        """`rows` as lists in db.LOG_COLUMNS order (get_log_rows_after_serial)."""
+        cutoff = self.cutoff().strftime(_FMT)
+        changes: Dict[Tuple[str, str], List[int]] = {}  # (bucket, door) -> [entries, exits, inside delta]
+        moved: Dict[str, Tuple[str, Optional[str]]] = {}
+        for r in sorted(rows, key=lambda r: (r[_TS] or "", r[_SERIAL] or 0)):
+            d = normalize_direction(r[_DIRECTION])
+            ts = r[_TS]
+            if d not in ("vhod", "vihod") or not ts:
+                continue
+            b = bucket_of(ts)
+            if b < cutoff:
+                continue
+            door = r[_DOOR] or ""
+            c = changes.setdefault((b, door), [0, 0, 0])
+            c[0 if d == "vhod" else 1] += 1
+
+            emp = str(r[_EMP] or "").strip()
+            if not emp:
+                continue
+            prev = self._people.get(emp)
+            if prev is not None and prev[0] > ts:
+                continue  # older than what we know about this person
+            if prev is not None and prev[1] is not None:
+                changes.setdefault((b, prev[1]), [0, 0, 0])[2] -= 1
+            now_in = door if d == "vhod" else None
+            if now_in is not None:
+                c[2] += 1
+            self._people[emp] = moved[emp] = (ts, now_in)
+
+        for (b, door), (ins, outs, delta) in sorted(changes.items()):
+            if door not in self._doors:
+                cn.execute("INSERT OR IGNORE INTO door(deviceName) VALUES (?)", (door,))
+                self._doors.add(door)
+            cur = cn.execute("UPDATE occupancy SET entries = entries + ?, exits = exits + ? "
+                             "WHERE bucket = ? AND deviceName = ?", (ins, outs, b, door))
+            if cur.rowcount == 0:
+                prev = cn.execute("SELECT inside FROM occupancy WHERE deviceName = ? AND bucket < ? "
+                                  "ORDER BY bucket DESC LIMIT 1", (door, b)).fetchone()
+                cn.execute("INSERT INTO occupancy VALUES (?, ?, ?, ?, ?)", (b, door, ins, outs, prev[0] if prev else 0))
+            if delta:
+                # normally just this row; more when the bucket is older than the door's latest
+                cn.execute("UPDATE occupancy SET inside = inside + ? WHERE deviceName = ? AND bucket >= ?",
+                           (delta, door, b))
+        cn.executemany("INSERT OR REPLACE INTO person(employeeID, lastTime, door) VALUES (?, ?, ?)",
+                       [(e, t, d) for e, (t, d) in moved.items()])
+
+    def _prune(self, cn: sqlite3.Connection) -> None:
+        """Drop buckets older than the window, keeping each door's last one as the starting value."""
+        cut = self.cutoff().strftime(_FMT)
+        n = cn.execute("""
+            DELETE FROM occupancy
+            WHERE bucket < ?
+              AND bucket < (SELECT MAX(o.bucket) FROM occupancy o
+                            WHERE o.deviceName = occupancy.deviceName AND o.bucket < ?)
+        """, (cut, cut)).rowcount
+        if n:
+            logger.info("Occupancy: dropped %s bucket row(s) before %s", n, cut)
+
+    def step(self) -> int:
+        """Apply one batch of new rows; returns how many were read."""
+        cn = self._open()
+        try:
+            if self.last_serial is None:
+                self._load(cn)
+            rows = db.get_log_rows_after_serial(self.conn_str, self.table, self.last_serial, self.batch)
+            with cn:
+                if rows:
+                    self._apply(cn, rows)
+                    self.last_serial = int(rows[-1][_SERIAL])
+                    cn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('lastSerial', ?)",
+                               (str(self.last_serial),))
+                if self._pruned != date.today():
+                    self._prune(cn)
+                    self._pruned = date.today()
+        except Exception:
+            # the in-memory people map may hold rows that were rolled back
+            self.last_serial = None
+            raise
+        finally:
+            cn.close()
+        self.applied += len(rows)
+        if len(rows) < self.batch and not self.ready:
+            self.ready = True
+            logger.info("Occupancy store caught up at serialNo=%s", self.last_serial)
+        return len(rows)
+
+    def ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=run_woken, name="ivms-occupancy", daemon=True,
+                                            args=(self.step, self.batch, self._wake, logger, "Occupancy"))
+            self._thread.start()
+
+    # ----- queries -----
+
+    def series(self, first: date, last: date, door: Optional[str] = None, step_minutes: int = BUCKET_MINUTES,
+               by_door: bool = False) -> Dict[str, Any]:
+        """
+        Per-step entries, exits and inside (at the end of the step) over the
+        days [first, last], for one door or all of them; with `by_door` the
+        per-door series are returned too.
+        """
+        if step_minutes < BUCKET_MINUTES or step_minutes % BUCKET_MINUTES or 1440 % step_minutes:
+            raise db.FilterError(f"bad step: {step_minutes}, expected a multiple of {BUCKET_MINUTES} minutes "
+                                 f"dividing a day")
+        last = min(last, date.today())  # nothing is stored past today (and date.max + 1 day overflows)
+        if (last - first).days >= self.days:
+            raise db.FilterError(f"span {first}..{last} is longer than the {self.days} days kept")
+        start = datetime.combine(max(first, self.cutoff().date()), datetime.min.time())
+        end = datetime.combine(last + timedelta(days=1), datetime.min.time())
+        n = max(0, int((end - start).total_seconds() // 60) // step_minutes)
+
+        cn = self._open()
+        try:
+            doors = [door] if door else sorted(d for (d,) in cn.execute("SELECT deviceName FROM door"))
+            base: Dict[str, int] = {}
+            for d in doors:
+                r = cn.execute("SELECT inside FROM occupancy WHERE deviceName = ? AND bucket < ? "
+                               "ORDER BY bucket DESC LIMIT 1", (d, start.strftime(_FMT))).fetchone()
+                base[d] = r[0] if r else 0
+            sql = "SELECT bucket, deviceName, entries, exits, inside FROM occupancy WHERE bucket >= ? AND bucket < ?"
+            params: List[Any] = [start.strftime(_FMT), end.strftime(_FMT)]
+            if door:
+                sql += " AND deviceName = ?"
+                params.append(door)
+            rows = cn.execute(sql + " ORDER BY bucket", params).fetchall()
+        finally:
+            cn.close()
+
+        per_step = step_minutes // BUCKET_MINUTES
+        slot = {(start + timedelta(minutes=k * BUCKET_MINUTES)).strftime(_FMT): k // per_step
+                for k in range(n * per_step)}
+        per: Dict[str, Dict[str, List[Any]]] = {
+            d: {"entries": [0] * n, "exits": [0] * n, "inside": [None] * n} for d in (doors if by_door else ())
+        }
+        total: Dict[str, List[Any]] = {"entries": [0] * n, "exits": [0] * n, "inside": [None] * n}
+        last = dict(base)
+        inside_now = sum(base.values())
+        for b, d, ins, outs, inside in rows:
+            if d not in last:
+                continue  # a door that appeared after the door list was read
+            i = slot[b]
+            total["entries"][i] += ins
+            total["exits"][i] += outs
+            inside_now += inside - last[d]
+            last[d] = inside
+            total["inside"][i] = inside_now  # rows are in bucket order: the last one wins
+            s = per.get(d)
+            if s is not None:
+                s["entries"][i] += ins
+                s["exits"][i] += outs
+                s["inside"][i] = inside
+        # steps without rows keep the value of the step before
+        for values, cur in [(s["inside"], base[d]) for d, s in per.items()] + [(total["inside"], sum(base.values()))]:
+            for i, v in enumerate(values):
+                cur = v if v is not None else cur
+                values[i] = cur
+
+        out: Dict[str, Any] = {
+            "from": start.strftime(_FMT),
+            "stepMinutes": step_minutes,
+            "buckets": [(start + timedelta(minutes=i * step_minutes)).strftime(_FMT) for i in range(n)],
+            "door": door or None,
+            "total": total,
+            "lastSerial": self.last_serial,
+            "ready": self.ready,
+        }
+        if by_door:
+            out["doors"] = per
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "days": self.days,
+            "bucketMinutes": BUCKET_MINUTES,
+            "ready": self.ready,
+            "lastSerial": self.last_serial,
+            "applied": self.applied,
+            "doors": len(self._doors),
+            "inside": sum(1 for _, d in list(self._people.values()) if d is not None),
+        }
@@ -0,0 +1,133 @@
+"""
+parallel.py — worktime over a process pool, partitioned by employeeID.
+
+In/out pairing only ever looks at one employee's events, so a long report
+(a quarter for thousands of people) splits cleanly: the employees matching
+the filters are cut into contiguous employeeID ranges of about the same
+number of events, and each worker process reads its range
+(db.iter_worktime_rows with employee_range), pairs it and sends back the
+folds. Ranges are submitted in employeeID order and collected in that
+order, so the folds come out exactly as a single pass would produce them.
+
+The WHERE clause is built once here, with this process's hooks (people
+index, text side table, mirror), and shipped to the workers as SQL text
+and parameters, so filter semantics do not depend on which process reads.
+
+Workers are started with "spawn" (the only method on Windows, and no
+inherited DB connections or lock state on Linux); they live as long as
+the service. Spawn re-imports the main script (app.py) in every worker, so
+app.py keeps its service setup (log files, live tail, local stores) out
+of import time, in start_service() and the stores' first use.
+
+    IVMS_WORKTIME_PROCESSES=4
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import db
+from analytics import WorktimeFold, iter_day_folds, iter_folds
+
+logger = logging.getLogger("ivms.parallel")
+
+Folds = List[Tuple[Optional[date], WorktimeFold]]
+
+
+def _fold_range(conn_str: str, table: str, where: Tuple[str, List[Any]],
+                lo: Optional[str], hi: Optional[str], by_day: bool) -> Folds:
+    """Worker: pair the events of lo <= employeeID < hi."""
+    rows = db.iter_worktime_rows(conn_str, table, {}, where=where, employee_range=(lo, hi))
+    if by_day:
+        return list(iter_day_folds(rows))
+    return [(None, f) for f in iter_folds(rows)]
+
+
+def plan_ranges(counts: List[Tuple[str, int]], parts: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Cut (employeeID, events) pairs, in employeeID order, into at most `parts`
+    contiguous [lo, hi) ranges of about equal event counts. The first range
+    has no lower bound and the last no upper bound, so together they cover
+    everything the filters match.
+    """
+    total = sum(n for _, n in counts)
+    target = total / max(1, parts)
+    bounds: List[Optional[str]] = [None]
+    acc = 0
+    for emp, n in counts:
+        if acc >= target * len(bounds) and len(bounds) < parts:
+            bounds.append(emp)
+        acc += n
+    bounds.append(None)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class WorktimePool:
+    def __init__(self, processes: int, min_rows: int = 200000, tasks_per_process: int = 4):
+        self.processes = max(0, processes)
+        # below this many events the pool costs more than it saves
+        self.min_rows = min_rows
+        # a few ranges per process, so one slow range does not idle the rest
+        self.tasks_per_process = tasks_per_process
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.serial_runs = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+                logger.info("Worktime process pool: %s process(es)", self.processes)
+            return self._executor
+
+    def folds(self, conn_str: str, table: str, filters: Dict[str, str],
+              by_day: bool = False) -> Iterator[Tuple[Optional[date], WorktimeFold]]:
+        """
+        (day, fold) per employee — or per employee and day with `by_day`;
+        day is None otherwise — in (employeeID, day) order, like
+        iter_folds / iter_day_folds over db.iter_worktime_rows. Bad filters
+        raise here, before anything is read.
+        """
+        where = db.build_where(filters, conn_str in db.MIRRORS)
+        if self.processes > 1:
+            counts = db.get_employee_counts(conn_str, table, filters, where=where)
+            if sum(n for _, n in counts) >= self.min_rows:
+                ranges = plan_ranges(counts, self.processes * self.tasks_per_process)
+                pool = self._pool()
+                futures = [pool.submit(_fold_range, conn_str, table, where, lo, hi, by_day) for lo, hi in ranges]
+                self.runs += 1
+                return self._collect(futures)
+        self.serial_runs += 1
+        rows = db.iter_worktime_rows(conn_str, table, filters, where=where)
+        return iter_day_folds(rows) if by_day else ((None, f) for f in iter_folds(rows))
+
+    @staticmethod
+    def _collect(futures: List[Future]) -> Iterator[Tuple[Optional[date], WorktimeFold]]:
+        try:
+            for fut in futures:
+                yield from fut.result()
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "minRows": self.min_rows,
+            "started": self._executor is not None,
+            "parallelRuns": self.runs,
+            "serialRuns": self.serial_runs,
+        }
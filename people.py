@@ -0,0 +1,171 @@
+"""
+people.py — person directory for the search box.
+
+Distinct (employeeID, personName, cardNo) values with repaired text and a
+trigram index. A search string resolves to a set of employeeIDs in memory,
+so SQL can seek on `employeeID IN (...)` instead of scanning with
+LIKE '%...%' (twice, because of the mojibake variant).
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import db
+from utils import to_hik_mojibake, try_fix_cp1251_mojibake
+
+logger = logging.getLogger("ivms.people")
+
+# employeeID, personName as stored, repaired personName, cardNo — casefolded
+Entry = Tuple[str, str, str, str]
+_RAW_NAME = 1
+
+# LIKE wildcards: such searches keep the SQL path to mean the same thing
+_LIKE_CHARS = set("%_[")
+
+
+def _trigrams(s: str) -> Set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class PersonDirectory:
+    def __init__(self, conn_str: str, table: str, refresh_seconds: float = 60.0, max_ids: int = 500):
+        self.conn_str = conn_str
+        self.table = table
+        self.refresh_seconds = refresh_seconds
+        # more matches than this: let SQL do the LIKE (keeps IN (...) well under
+        # the parameter limits of SQL Server and SQLite)
+        self.max_ids = max_ids
+
+        self._entries: List[Entry] = []
+        self._emp_ids: List[str] = []
+        self._seen: Set[Entry] = set()
+        self._index: Dict[str, Set[int]] = {}
+        self._last_serial = 0
+        self._refreshed_at = 0.0
+        self._ready = False
+        self._lock = threading.Lock()
+        self._loader: Optional[threading.Thread] = None
+
+    # ----- building -----
+
+    def _add(self, emp: str, name: str, card: str) -> None:
+        e = (emp.casefold(), name.casefold(), try_fix_cp1251_mojibake(name).casefold(), card.casefold())
+        if e in self._seen:
+            return
+        self._seen.add(e)
+        i = len(self._entries)
+        self._entries.append(e)
+        self._emp_ids.append(emp)
+        for field in e:
+            for g in _trigrams(field):
+                self._index.setdefault(g, set()).add(i)
+
+    def _load(self, after_serial: Optional[int]) -> None:
+        people, top = db.get_people(self.conn_str, self.table, after_serial=after_serial)
+        with self._lock:
+            for emp, name, card in people:
+                self._add(emp, name, card)
+            self._last_serial = max(self._last_serial, top)
+            self._refreshed_at = time.monotonic()
+
+    def ensure_started(self) -> None:
+        """Build the directory in the background; searches use SQL until it's ready."""
+        with self._lock:
+            if self._loader is not None:
+                return
+            self._loader = threading.Thread(target=self._initial_load, name="ivms-people", daemon=True)
+            self._loader.start()
+
+    def _initial_load(self) -> None:
+        try:
+            t0 = time.monotonic()
+            self._load(None)
+            self._ready = True
+            logger.info("Person directory ready: %s entries in %.1fs", len(self._entries), time.monotonic() - t0)
+        except Exception as e:
+            logger.exception("Person directory load failed: %s", e)
+            with self._lock:
+                self._loader = None  # retry on the next search
+
+    def add_rows(self, rows) -> None:
+        """Live feed listener: new people show up in search immediately."""
+        if not self._ready:
+            return
+        with self._lock:
+            for r in rows:
+                self._add(str(r.get("employeeID") or ""), r.get("personName") or "", r.get("cardNo") or "")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    # ----- lookup -----
+
+    def _candidates(self, q: str) -> Optional[Set[int]]:
+        """Entries holding every trigram of `q`; None when `q` is too short to narrow."""
+        if len(q) < 3:
+            return None
+        postings = [self._index.get(g) for g in _trigrams(q)]
+        if any(p is None for p in postings):
+            return set()
+        postings.sort(key=len)
+        cand = set(postings[0])
+        for p in postings[1:]:
+            cand &= p
+            if not cand:
+                break
+        return cand
+
+    def resolve(self, search: str) -> Optional[List[str]]:
+        """
+        employeeIDs whose ID, name or card contains `search` (case-insensitive),
+        or whose stored name contains its mojibake form — the repair is lossy
+        ("И" loses its second byte), so this is what the SQL LIKE on the raw
+        column matches. None when the directory can't answer exactly: not
+        loaded yet, too many matches, or a match without an employeeID.
+        """
+        self.ensure_started()
+        if not self._ready:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            stale = now - self._refreshed_at > self.refresh_seconds
+            if stale:
+                self._refreshed_at = now  # one refresher at a time
+        if stale:
+            try:
+                self._load(self._last_serial)
+            except Exception as e:
+                logger.warning("Person directory refresh failed: %s", e)
+
+        q = search.casefold()
+        if not q or _LIKE_CHARS & set(q):
+            return None
+
+        q_moji = to_hik_mojibake(search).casefold()
+
+        with self._lock:
+            plain, moji = self._candidates(q), self._candidates(q_moji)
+            if plain is None or moji is None:
+                cand = range(len(self._entries))
+            else:
+                cand = sorted(plain | moji)
+
+            ids: Set[str] = set()
+            for i in cand:
+                e = self._entries[i]
+                if any(q in f for f in e) or (q_moji and q_moji in e[_RAW_NAME]):
+                    emp = self._emp_ids[i]
+                    if not emp.strip():
+                        return None
+                    ids.add(emp)
+                    if len(ids) > self.max_ids:
+                        return None
+        return sorted(ids)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "trigrams": len(self._index), "lastSerial": self._last_serial}
@@ -0,0 +1,131 @@
+"""
+presence.py — in-memory "who is where": employeeID -> latest event.
+
+Bootstrapped once from the DB (or from a snapshot on disk plus the rows added
+since), then kept current by the live feed. Serves /api/summary for the
+default views without touching the DB.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import db
+from analytics import compute_summary
+
+logger = logging.getLogger("ivms.presence")
+
+_KEEP = ("serialNo", "employeeID", "authDateTime", "direction", "deviceName", "personName", "cardNo")
+
+
+class PresenceState:
+    def __init__(self, conn_str: str, table: str, snapshot_path: str, save_every: float = 30.0):
+        self.conn_str = conn_str
+        self.table = table
+        self.snapshot_path = snapshot_path
+        self.save_every = save_every
+
+        self.last_serial = 0
+        self._by_emp: Dict[str, Dict[str, Any]] = {}
+        self._ready = False
+        self._dirty = False
+        self._saved_at = 0.0
+        self._lock = threading.RLock()
+
+    # ----- state -----
+
+    def _apply(self, row: Dict[str, Any]) -> bool:
+        emp = str(row.get("employeeID") or "").strip()
+        if not emp:
+            return False
+        serial = int(row.get("serialNo") or 0)
+        cur = self._by_emp.get(emp)
+        if cur is not None and int(cur.get("serialNo") or 0) >= serial:
+            return False
+        self._by_emp[emp] = {k: row.get(k) for k in _KEEP}
+        return True
+
+    def apply_rows(self, rows: List[Dict[str, Any]]) -> None:
+        """Live feed listener: fold new rows into the state."""
+        with self._lock:
+            if not self._ready:
+                return
+            for r in rows:
+                if self._apply(r):
+                    self._dirty = True
+                self.last_serial = max(self.last_serial, int(r.get("serialNo") or 0))
+            if self._dirty and time.monotonic() - self._saved_at > self.save_every:
+                self.save()
+
+    def ensure_ready(self) -> None:
+        with self._lock:
+            if self._ready:
+                return
+            since = self.load()
+            top = db.get_max_serialno(self.conn_str, self.table)
+            # set-based catch-up: only employees with events after the snapshot
+            for r in db.get_last_by_employee(self.conn_str, self.table, {}, after_serial=since or None):
+                self._apply(r)
+            self.last_serial = max(since, top)
+            self._ready = True
+            self._dirty = True
+            self.save()
+            logger.info("Presence ready: %s employees, serialNo=%s (snapshot serialNo=%s)",
+                        len(self._by_emp), self.last_serial, since)
+
+    # ----- snapshot -----
+
+    def load(self) -> int:
+        """Restore the snapshot; returns its serialNo (0 when there is none)."""
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            self._by_emp = dict(snap.get("employees") or {})
+            return int(snap.get("lastSerial") or 0)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.warning("Presence snapshot ignored (%s): %s", self.snapshot_path, e)
+            self._by_emp = {}
+            return 0
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            snap = {"lastSerial": self.last_serial, "employees": self._by_emp}
+            tmp = self.snapshot_path + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snap, f, ensure_ascii=False)
+                os.replace(tmp, self.snapshot_path)
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            except OSError as e:
+                logger.warning("Presence snapshot not saved: %s", e)
+
+    # ----- queries -----
+
+    def summary(self, filters: Dict[str, str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Summary from memory for "no filter" and "today"; None means the
+        filters need the DB.
+        """
+        f = {k: v for k, v in filters.items() if v}
+        today = date.today().isoformat()
+        if not f:
+            prefix = ""
+        elif set(f) <= {"dateFrom", "dateTo"} and f.get("dateFrom") == today and f.get("dateTo", today) == today:
+            prefix = today
+        else:
+            return None
+
+        with self._lock:
+            events = [e for e in self._by_emp.values() if str(e.get("authDateTime") or "").startswith(prefix)]
+        return compute_summary(events)
@@ -0,0 +1,261 @@
+"""
+rollup.py — per-employee per-day worktime rollup in a local SQLite file.
+
+Closed days (before today) never change, so each one is folded once and
+stored. A worktime report over past days reads the stored folds and merges
+them; only today is computed live. A background thread keeps the store up to
+date from the highest processed serialNo (late rows for past days rebuild
+just those days).
+"""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import db
+from analytics import WorktimeFold, iter_folds
+
+logger = logging.getLogger("ivms.rollup")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS worktime_day (
+    employeeID    TEXT    NOT NULL,
+    day           TEXT    NOT NULL,
+    personName    TEXT,
+    cardNo        TEXT,
+    firstIn       TEXT,
+    lastOut       TEXT,
+    leadOut       TEXT,
+    openIn        TEXT,
+    totalSeconds  INTEGER NOT NULL,
+    unmatched     INTEGER NOT NULL,
+    PRIMARY KEY (employeeID, day)
+);
+CREATE INDEX IF NOT EXISTS ix_worktime_day_day ON worktime_day(day);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_TS = "%Y-%m-%d %H:%M:%S"
+
+
+def _ts(v: Optional[datetime]) -> Optional[str]:
+    return v.strftime(_TS) if v else None
+
+
+def _dt(v: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(v, _TS) if v else None
+
+
+def fold_to_row(day: date, f: WorktimeFold) -> tuple:
+    return (
+        f.employeeID, day.isoformat(), f.person_name, f.card_no,
+        _ts(f.first_in), _ts(f.last_out), _ts(f.lead_out), _ts(f.open_in),
+        int(f.total.total_seconds()), f.unmatched,
+    )
+
+
+def fold_from_row(r: sqlite3.Row) -> WorktimeFold:
+    f = WorktimeFold(r["employeeID"])
+    f.person_name = r["personName"] or ""
+    f.card_no = r["cardNo"] or ""
+    f.first_in = _dt(r["firstIn"])
+    f.last_out = _dt(r["lastOut"])
+    f.lead_out = _dt(r["leadOut"])
+    f.open_in = _dt(r["openIn"])
+    f.total = timedelta(seconds=r["totalSeconds"])
+    f.unmatched = r["unmatched"]
+    return f
+
+
+class WorktimeRollup:
+    def __init__(self, conn_str: str, table: str, path: str, refresh_seconds: float = 60.0):
+        self.conn_str = conn_str
+        self.table = table
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._schema = False  # created on first use, not at import of app.py
+
+    def _open(self) -> sqlite3.Connection:
+        cn = sqlite3.connect(self.path, timeout=30)
+        cn.row_factory = sqlite3.Row
+        cn.execute("PRAGMA journal_mode=WAL")
+        if not self._schema:
+            cn.executescript(_SCHEMA)
+            self._schema = True
+        return cn
+
+    # ----- meta -----
+
+    def _meta(self, cn: sqlite3.Connection, key: str) -> Optional[str]:
+        r = cn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return r[0] if r else None
+
+    def _set_meta(self, cn: sqlite3.Connection, key: str, value: Any) -> None:
+        cn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, str(value)))
+
+    def closed_through(self) -> Optional[date]:
+        """Last day fully stored in the rollup, or None if it was never built."""
+        cn = self._open()
+        try:
+            v = self._meta(cn, "closedThrough")
+        finally:
+            cn.close()
+        return date.fromisoformat(v) if v else None
+
+    # ----- maintenance -----
+
+    def _rebuild_day(self, cn: sqlite3.Connection, day: date) -> int:
+        d = day.isoformat()
+        rows = db.iter_worktime_rows(self.conn_str, self.table, {"dateFrom": d, "dateTo": d})
+        data = [fold_to_row(day, f) for f in iter_folds(rows)]
+        cn.execute("DELETE FROM worktime_day WHERE day = ?", (d,))
+        cn.executemany("INSERT INTO worktime_day VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", data)
+        return len(data)
+
+    def refresh(self) -> int:
+        """Bring closed days up to date; returns the number of days rebuilt."""
+        with self._lock:
+            yesterday = date.today() - timedelta(days=1)
+            top = db.get_max_serialno(self.conn_str, self.table)
+
+            cn = self._open()
+            try:
+                last = int(self._meta(cn, "lastSerial") or 0)
+                closed_v = self._meta(cn, "closedThrough")
+                closed = date.fromisoformat(closed_v) if closed_v else None
+
+                if closed is None:
+                    days = set(db.get_event_dates(self.conn_str, self.table))
+                else:
+                    days = set()
+                    if top > last:
+                        # rows that arrived late for already closed days
+                        days.update(db.get_event_dates(self.conn_str, self.table, after_serial=last))
+                    d = closed + timedelta(days=1)
+                    while d <= yesterday:
+                        days.add(d)
+                        d += timedelta(days=1)
+
+                todo = sorted(d for d in days if d <= yesterday)
+                for d in todo:
+                    n = self._rebuild_day(cn, d)
+                    cn.commit()
+                    logger.debug("Rollup day %s: %s employees", d, n)
+
+                self._set_meta(cn, "lastSerial", top)
+                self._set_meta(cn, "closedThrough", yesterday.isoformat())
+                cn.commit()
+            finally:
+                cn.close()
+
+            if todo:
+                logger.info("Worktime rollup refreshed: %s day(s), serialNo=%s", len(todo), top)
+            return len(todo)
+
+    def ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="ivms-worktime-rollup", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.exception("Worktime rollup error: %s", e)
+            time.sleep(self.refresh_seconds)
+
+    # ----- queries -----
+
+    def _iter_stored(self, first: Optional[date], last: date,
+                     employee_ids: Optional[List[str]] = None) -> Iterator[WorktimeFold]:
+        """Stored day folds in [first, last], merged per employee."""
+        sql = "SELECT * FROM worktime_day WHERE day <= ?"
+        params: List[Any] = [last.isoformat()]
+        if first is not None:
+            sql += " AND day >= ?"
+            params.append(first.isoformat())
+        if employee_ids is not None:
+            sql += " AND employeeID IN (" + ", ".join("?" * len(employee_ids)) + ")"
+            params.extend(employee_ids)
+        sql += " ORDER BY employeeID, day"
+
+        cn = self._open()
+        try:
+            acc: Optional[WorktimeFold] = None
+            for r in cn.execute(sql, params):
+                f = fold_from_row(r)
+                if acc is not None and acc.employeeID == f.employeeID:
+                    acc.merge(f)
+                    continue
+                if acc is not None:
+                    yield acc
+                acc = f
+            if acc is not None:
+                yield acc
+        finally:
+            cn.close()
+
+    def worktime(self, filters: Dict[str, str],
+                 employee_ids: Optional[List[str]] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Worktime report from the rollup plus today's live events, optionally
+        for some employees only. Returns None when the filters (door/time, a
+        search the person directory can't resolve) or the state of the store
+        require the regular streaming path.
+        """
+        f = {k: v for k, v in filters.items() if v}
+        search = f.pop("search", None)
+        if not set(f) <= {"dateFrom", "dateTo"}:
+            return None
+        if search:
+            ids = db.SEARCH_RESOLVER(search) if db.SEARCH_RESOLVER is not None else None
+            if ids is None:
+                return None
+            if employee_ids is not None:
+                wanted = set(ids)
+                ids = [e for e in employee_ids if e in wanted]
+            if not ids:
+                return []
+            employee_ids = ids
+
+        today = date.today()
+        first = db.parse_date(f["dateFrom"], "dateFrom") if f.get("dateFrom") else None
+        last = db.parse_date(f["dateTo"], "dateTo") if f.get("dateTo") else today
+        if first is not None and first >= today:
+            return None  # nothing closed in range
+        closed = self.closed_through()
+        if closed is None or closed < min(last, today - timedelta(days=1)):
+            return None  # store is still catching up
+
+        by_emp: Dict[str, WorktimeFold] = {
+            fold.employeeID: fold for fold in self._iter_stored(first, min(last, closed), employee_ids)
+        }
+
+        if last >= today:
+            t = today.isoformat()
+            rows = db.iter_worktime_rows(self.conn_str, self.table, {"dateFrom": t, "dateTo": t},
+                                         employee_ids=employee_ids)
+            for fold in iter_folds(rows):
+                acc = by_emp.get(fold.employeeID)
+                if acc is None:
+                    by_emp[fold.employeeID] = fold
+                else:
+                    acc.merge(fold)
+
+        result = [fold.result() for fold in by_emp.values()]
+        result.sort(key=lambda x: (x["personName"], x["employeeID"]))
+        return result
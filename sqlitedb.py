@@ -0,0 +1,125 @@
+"""
+sqlitedb.py — SQLite stand-in for the attlog database.
+
+`db.py` speaks T-SQL through pyodbc. With a `sqlite:///path/to/file.db`
+connection string it gets a sqlite3 connection wrapped so that the same
+queries run unchanged: the few T-SQL spellings used in db.py are rewritten
+(TOP n -> LIMIT n, ISNULL, CAST(... AS date), CONVERT(time, ...), the `dbo.`
+schema prefix). Used for offline development and the benchmark suite.
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Iterable, Sequence
+
+PREFIX = "sqlite:///"
+
+_TS = "%Y-%m-%d %H:%M:%S"
+
+# same on-disk format as the generator writes, so text comparison == time comparison
+sqlite3.register_adapter(datetime, lambda v: v.strftime(_TS))
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    serialNo      INTEGER PRIMARY KEY,
+    employeeID    TEXT,
+    authDateTime  DATETIME,
+    authDate      TEXT,
+    authTime      TEXT,
+    direction     TEXT,
+    deviceName    TEXT,
+    deviceSN      TEXT,
+    personName    TEXT,
+    cardNo        TEXT,
+    doorName      TEXT,
+    readerName    TEXT
+);
+CREATE INDEX IF NOT EXISTS IX_{name}_authDateTime ON {table}(authDateTime);
+CREATE INDEX IF NOT EXISTS IX_{name}_deviceName ON {table}(deviceName);
+CREATE INDEX IF NOT EXISTS IX_{name}_employeeID_serialNo ON {table}(employeeID, serialNo);
+CREATE INDEX IF NOT EXISTS IX_{name}_employeeID_authDateTime ON {table}(employeeID, authDateTime);
+"""
+
+
+def is_sqlite(conn_str: str) -> bool:
+    return conn_str.startswith(PREFIX)
+
+
+def path_of(conn_str: str) -> str:
+    # sqlite:///relative.db, sqlite:////absolute/path.db
+    return conn_str[len(PREFIX):]
+
+
+_TOP_RE = re.compile(r"\bSELECT\s+TOP\s+(\d+)\s", re.IGNORECASE)
+_CAST_DATE_RE = re.compile(r"\bCAST\(\s*([\w.]+)\s+AS\s+date\s*\)", re.IGNORECASE)
+_CONVERT_TIME_RE = re.compile(r"\bCONVERT\(\s*time(?:\(\d\))?\s*,\s*([\w.]+)\s*\)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def translate(sql: str) -> str:
+    """T-SQL as written in db.py -> SQLite."""
+    limit = None
+    m = _TOP_RE.search(sql)
+    if m:
+        limit = m.group(1)
+        sql = sql[:m.start()] + "SELECT " + sql[m.end():]
+    sql = re.sub(r"\bdbo\.", "", sql)
+    sql = re.sub(r"\bISNULL\(", "IFNULL(", sql, flags=re.IGNORECASE)
+    sql = _CAST_DATE_RE.sub(r"date(\1)", sql)
+    sql = _CONVERT_TIME_RE.sub(r"time(\1)", sql)
+    if limit is not None:
+        sql = sql.rstrip().rstrip(";") + f" LIMIT {limit}"
+    return sql
+
+
+class Cursor:
+    def __init__(self, cur: sqlite3.Cursor):
+        self._cur = cur
+        self.fast_executemany = False  # pyodbc knob, meaningless here
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> "Cursor":
+        self._cur.execute(translate(sql), tuple(params))
+        return self
+
+    def executemany(self, sql: str, seq: Iterable[Sequence[Any]]) -> "Cursor":
+        self._cur.executemany(translate(sql), seq)
+        return self
+
+    def __getattr__(self, name: str) -> Any:
+        # fetchone / fetchmany / fetchall / description / close
+        return getattr(self._cur, name)
+
+
+class Connection:
+    def __init__(self, cn: sqlite3.Connection):
+        self._cn = cn
+
+    def cursor(self) -> Cursor:
+        return Cursor(self._cn.cursor())
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cn, name)
+
+
+def connect(conn_str: str) -> Connection:
+    # autocommit like db_connect's pyodbc connections; pooled across threads
+    cn = sqlite3.connect(path_of(conn_str), timeout=30, isolation_level=None,
+                         check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+    cn.execute("PRAGMA journal_mode=WAL")
+    cn.execute("PRAGMA cache_size=-65536")  # 64 MB
+    return Connection(cn)
+
+
+def create_schema(conn_str: str, table: str) -> None:
+    name = table.split(".")[-1]
+    cn = sqlite3.connect(path_of(conn_str))
+    try:
+        cn.executescript(SCHEMA.format(table=name, name=name))
+    finally:
+        cn.close()
@@ -0,0 +1,208 @@
+"""
+tail.py — when the live feed looks for new rows.
+
+LiveFeed reads new rows with `db.get_log_after_serial` (keyset on serialNo);
+a Tail decides how long to wait between those reads:
+
+- PollingTail: plain sleeps, adaptive — back to `min_seconds` as soon as a
+  poll finds rows, stretched up to `max_seconds` while the table is idle.
+- ChangeTrackingTail: probes a change counter every `check_seconds` and
+  returns as soon as it moves: SQL Server Change Tracking
+  (CHANGE_TRACKING_CURRENT_VERSION(), no read of the table itself) or, on
+  the SQLite stand-in, PRAGMA data_version.
+- WaitforTail: long polling inside SQL Server — one batch loops over
+  `WAITFOR DELAY` until a row after the last serialNo exists, so an idle
+  night costs one round trip per `max_seconds` and a new event is seen
+  within `step_ms`.
+
+    IVMS_LIVE_TAIL=poll|ct|waitfor
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+import db
+import sqlitedb
+
+logger = logging.getLogger("ivms.tail")
+
+
+class Backoff:
+    """Wait interval: `low` after activity, times `factor` per idle round up to `high`."""
+
+    def __init__(self, low: float, high: float, factor: float = 1.5):
+        self.low = low
+        self.high = max(low, high)
+        self.factor = factor
+        self.interval = low
+
+    def update(self, found: int) -> float:
+        if found:
+            self.interval = self.low
+        else:
+            self.interval = min(self.high, self.interval * self.factor)
+        return self.interval
+
+
+class Tail(ABC):
+    """Base: `wait()` blocks until rows after `last_serial` may exist."""
+
+    kind = "base"
+
+    def __init__(self, min_seconds: float = 0.25, max_seconds: float = 5.0):
+        self.backoff = Backoff(min_seconds, max_seconds)
+
+    @abstractmethod
+    def wait(self, last_serial: int, found: int) -> None:
+        """`found` is the number of rows the last poll returned."""
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "interval": round(self.backoff.interval, 3)}
+
+
+class PollingTail(Tail):
+    kind = "poll"
+
+    def wait(self, last_serial: int, found: int) -> None:
+        time.sleep(self.backoff.update(found))
+
+
+class _DedicatedConnection:
+    """
+    One connection outside the pool, reopened after errors. Version probes
+    need the same session every time (PRAGMA data_version is per connection)
+    and a long WAITFOR must not hold a pool slot.
+    """
+
+    def __init__(self, conn_str: str, query: str):
+        self.conn_str = conn_str
+        self.query = query
+        self._cn: Any = None
+
+    def cursor(self) -> Any:
+        if self._cn is None:
+            self._cn = db.TimedConnection(db.db_connect(self.conn_str), self.query)
+        return self._cn.cursor()
+
+    def reset(self) -> None:
+        cn, self._cn = self._cn, None
+        if cn is not None:
+            try:
+                cn.close()
+            except Exception:
+                pass
+
+
+class ChangeTrackingTail(Tail):
+    """
+    Needs Change Tracking on the database (see migrate.py). The version is
+    database-wide, so writes to other tables cause an extra, empty poll.
+    """
+
+    kind = "ct"
+
+    def __init__(self, conn_str: str, min_seconds: float = 0.25, max_seconds: float = 5.0):
+        super().__init__(min_seconds, max_seconds)
+        self.check_seconds = min_seconds
+        self._sqlite = sqlitedb.is_sqlite(conn_str)
+        self._cn = _DedicatedConnection(conn_str, "tail_version")
+        self._version: Optional[int] = None
+        self._enabled: Optional[bool] = None  # known after the first probe
+        self.probes = 0
+
+    def _current(self) -> Optional[int]:
+        sql = "PRAGMA data_version" if self._sqlite else "SELECT CHANGE_TRACKING_CURRENT_VERSION()"
+        self.probes += 1
+        try:
+            cur = self._cn.cursor()
+            cur.execute(sql)
+            row = cur.fetchone()
+        except db.DB_ERRORS:
+            self._cn.reset()
+            raise
+        return None if row is None or row[0] is None else int(row[0])
+
+    def wait(self, last_serial: int, found: int) -> None:
+        if self._enabled is None:
+            self._version = self._current()
+            self._enabled = self._version is not None
+            if not self._enabled:
+                logger.warning("Change Tracking is not enabled for the database, falling back to polling")
+        if not self._enabled:
+            time.sleep(self.backoff.update(found))
+            return
+        # the poller also wakes every max_seconds (pending worktime deltas, safety net)
+        deadline = time.monotonic() + self.backoff.high
+        while time.monotonic() < deadline:
+            time.sleep(self.check_seconds)
+            v = self._current()
+            if v != self._version:
+                self._version = v
+                return
+
+    def close(self) -> None:
+        self._cn.reset()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "enabled": self._enabled, "checkSeconds": self.check_seconds,
+                "version": self._version, "probes": self.probes}
+
+
+class WaitforTail(Tail):
+    """SQL Server only: the wait happens in the server, on a dedicated connection."""
+
+    kind = "waitfor"
+
+    def __init__(self, conn_str: str, table: str, max_seconds: float = 30.0, step_ms: int = 200):
+        if sqlitedb.is_sqlite(conn_str):
+            raise ValueError("IVMS_LIVE_TAIL=waitfor needs SQL Server (WAITFOR DELAY)")
+        super().__init__(step_ms / 1000.0, max_seconds)
+        self.table = table
+        self.step_ms = int(step_ms)
+        self._cn = _DedicatedConnection(conn_str, "tail_waitfor")
+        self.waits = 0
+
+    def _sql(self) -> str:
+        ms = self.step_ms
+        delay = f"00:00:{ms // 1000:02d}.{ms % 1000:03d}"
+        return f"""
+            SET NOCOUNT ON;
+            DECLARE @until DATETIME2 = DATEADD(millisecond, ?, SYSUTCDATETIME());
+            WHILE NOT EXISTS (SELECT 1 FROM {self.table} WHERE serialNo > ?) AND SYSUTCDATETIME() < @until
+                WAITFOR DELAY '{delay}';
+            SELECT 1;
+        """
+
+    def wait(self, last_serial: int, found: int) -> None:
+        self.waits += 1
+        try:
+            cur = self._cn.cursor()
+            cur.execute(self._sql(), [int(self.backoff.high * 1000), int(last_serial)])
+            cur.fetchall()
+        except db.DB_ERRORS:
+            self._cn.reset()
+            raise
+
+    def close(self) -> None:
+        self._cn.reset()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"kind": self.kind, "maxSeconds": self.backoff.high, "stepMs": self.step_ms, "waits": self.waits}
+
+
+def make_tail(kind: str, conn_str: str, table: str, min_seconds: float, max_seconds: float) -> Tail:
+    kind = (kind or "poll").lower()
+    if kind == "poll":
+        return PollingTail(min_seconds, max_seconds)
+    if kind == "ct":
+        return ChangeTrackingTail(conn_str, min_seconds, max_seconds)
+    if kind == "waitfor":
+        return WaitforTail(conn_str, table, max_seconds=max(max_seconds, 1.0), step_ms=int(min_seconds * 1000))
+    raise ValueError(f"unknown IVMS_LIVE_TAIL={kind!r} (poll, ct, waitfor)")
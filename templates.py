@@ -27,6 +27,7 @@ table { border-collapse:collapse; width:100%; }
 th, td { border-bottom:1px solid #eee; padding:8px; text-align:left; }
 th { background:#fafafa; }
 .right { text-align:right; }
+.heat td { padding:4px; text-align:center; font-size:12px; min-width:26px; }
 .mono { font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace; }
 </style>
 </head>
@@ -57,16 +58,28 @@ th { background:#fafafa; }
       <button onclick="resetFilters()">Сброс</button>
     </div>
   </div>
+
+  <div class="f">
+    <label>Экспорт CSV</label>
+    <div style="display:flex; gap:8px;">
+      <button onclick="exportCsv('log')">Лог</button>
+      <button onclick="exportCsv('worktime', {byDay: '1'})">Время по дням</button>
+    </div>
+  </div>
 </div>
 
 <div class="tabs">
   <div class="tab active" onclick="showTab('log')">Лог</div>
   <div class="tab" onclick="showTab('summary')">Сводка (кто где)</div>
   <div class="tab" onclick="showTab('worktime')">Отчёт времени</div>
+  <div class="tab" onclick="showTab('occupancy')">Загруженность</div>
 </div>
 
 <div id="tab_log" class="panel active">
   <div class="log" id="log"></div>
+  <div id="logMore" class="small" style="padding:10px; text-align:center; display:none;">
+    <button onclick="loadMore()">Загрузить ещё</button>
+  </div>
 </div>
 
 <div id="tab_summary" class="panel">
@@ -91,14 +104,36 @@ th { background:#fafafa; }
   </div>
 </div>
 
+<div id="tab_occupancy" class="panel">
+  <div class="toolbar">
+    <div class="f">
+      <label>Показатель (по часам)</label>
+      <select id="occMetric" onchange="renderOccupancy()">
+        <option value="inside">Внутри (на конец часа)</option>
+        <option value="entries">Входы</option>
+        <option value="exits">Выходы</option>
+      </select>
+    </div>
+    <div class="small" id="occInfo"></div>
+  </div>
+  <div class="log">
+    <table id="occTbl" class="heat"><thead></thead><tbody></tbody></table>
+  </div>
+</div>
+
 <script>
 let es = null;
 let liveOn = false;
+let lastEventId = '';  // serialNo of the last live batch seen, for resuming
+let nextCursor = null;
+let loadingMore = false;
+let loadedCount = 0;
+let occupancy = null;
 
 function showTab(name){
   document.querySelectorAll('.tab').forEach(t=>t.classList.remove('active'));
   document.querySelectorAll('.panel').forEach(p=>p.classList.remove('active'));
-  const idx = {log:0, summary:1, worktime:2}[name];
+  const idx = {log:0, summary:1, worktime:2, occupancy:3}[name];
   document.querySelectorAll('.tab')[idx].classList.add('active');
   document.getElementById('tab_'+name).classList.add('active');
 }
@@ -118,6 +153,11 @@ function qs(obj){
   return p.toString();
 }
 
+function exportCsv(kind, extra){
+  // streamed by the server: the download starts at once, whatever the size
+  window.location = '/api/export/' + kind + '?' + qs(Object.assign(getFilters(), extra || {}));
+}
+
 function dirLabel(d){
   d = (d||'').toLowerCase();
   if(d === 'vhod') return ['Вход','vhod'];
@@ -125,9 +165,12 @@ function dirLabel(d){
   return [d,''];
 }
 
+// rows newest first ('replace'/'append': a page of history), or oldest first
+// for 'prepend' (a live batch) — either way the newest ends up on top
 function renderLog(rows, mode){
   const box = document.getElementById('log');
   if(mode === 'replace') box.innerHTML = '';
+  const frag = document.createDocumentFragment();
   rows.forEach(e=>{
     const [lbl, cls] = dirLabel(e.direction);
     const row = document.createElement('div');
@@ -136,17 +179,15 @@ function renderLog(rows, mode){
       <div><b class="mono">${e.authDateTime}</b> — <span class="${cls}">${lbl}</span> — ${e.personName} <span class="small">(${e.employeeID||''})</span></div>
       <div class="small">Дверь: <b>${e.deviceName||''}</b> | Карта: ${e.cardNo||''} | serialNo: ${e.serialNo||''}</div>
     `;
-    if(mode === 'prepend' && box.firstChild) box.insertBefore(row, box.firstChild);
-    else box.appendChild(row);
+    if(mode === 'prepend') frag.insertBefore(row, frag.firstChild);
+    else frag.appendChild(row);
   });
+  if(mode === 'prepend') box.insertBefore(frag, box.firstChild);
+  else box.appendChild(frag);
 }
 
-function renderSummary(rows){
-  const tb = document.querySelector('#summaryTbl tbody');
-  tb.innerHTML = '';
-  rows.forEach(r=>{
-    const tr = document.createElement('tr');
-    tr.innerHTML = `
+function summaryRowHtml(r){
+  return `
       <td>${r.personName||''}</td>
       <td class="mono">${r.employeeID||''}</td>
       <td>${r.status||''}</td>
@@ -154,26 +195,87 @@ function renderSummary(rows){
       <td>${r.lastDeviceName||''}</td>
       <td class="mono">${r.cardNo||''}</td>
     `;
-    tb.appendChild(tr);
-  });
 }
 
-function renderWorktime(rows){
-  const tb = document.querySelector('#workTbl tbody');
-  tb.innerHTML = '';
-  rows.forEach(r=>{
-    const tr = document.createElement('tr');
-    tr.innerHTML = `
+function worktimeRowHtml(r){
+  return `
       <td>${r.personName||''}</td>
       <td class="mono">${r.employeeID||''}</td>
       <td class="mono">${r.firstIn||''}</td>
       <td class="mono">${r.lastOut||''}</td>
       <td class="mono right">${r.totalInside||'00:00:00'}</td>
     `;
+}
+
+function renderTable(sel, rows, rowHtml){
+  const tb = document.querySelector(sel + ' tbody');
+  tb.innerHTML = '';
+  rows.forEach(r=>{
+    const tr = document.createElement('tr');
+    tr.dataset.emp = r.employeeID || '';
+    tr.dataset.sort = (r.personName||'') + '\u0000' + (r.employeeID||'');
+    tr.innerHTML = rowHtml(r);
     tb.appendChild(tr);
   });
 }
 
+// live delta: replace rows of the given employees in place, insert new ones
+// at their sorted position (tables are ordered by personName, employeeID)
+function patchTable(sel, rows, rowHtml){
+  const tb = document.querySelector(sel + ' tbody');
+  rows.forEach(r=>{
+    const emp = r.employeeID || '';
+    let tr = Array.from(tb.children).find(x=>x.dataset.emp === emp);
+    const sortKey = (r.personName||'') + '\u0000' + emp;
+    if(tr && tr.dataset.sort !== sortKey){ tr.remove(); tr = null; }
+    if(!tr){
+      tr = document.createElement('tr');
+      tr.dataset.emp = emp;
+      tr.dataset.sort = sortKey;
+      const next = Array.from(tb.children).find(x=>x.dataset.sort > sortKey);
+      tb.insertBefore(tr, next || null);
+    }
+    tr.innerHTML = rowHtml(r);
+  });
+}
+
+function renderSummary(rows){ renderTable('#summaryTbl', rows, summaryRowHtml); }
+function renderWorktime(rows){ renderTable('#workTbl', rows, worktimeRowHtml); }
+
+// hourly heatmap: one row per day, one cell per hour (dates and door from the filters)
+async function loadOccupancy(){
+  const f = getFilters();
+  const q = {step: 60};
+  ['dateFrom','dateTo','door'].forEach(k=>{ if(f[k]) q[k] = f[k]; });
+  const r = await fetch('/api/occupancy?' + qs(q));
+  occupancy = r.ok ? await r.json() : null;
+  renderOccupancy();
+}
+
+function renderOccupancy(){
+  const tbl = document.getElementById('occTbl');
+  const info = document.getElementById('occInfo');
+  tbl.tHead.innerHTML = '';
+  tbl.tBodies[0].innerHTML = '';
+  if(!occupancy){ info.textContent = 'Нет данных'; return; }
+  const values = occupancy.total[document.getElementById('occMetric').value || 'inside'];
+  const max = Math.max(1, ...values);
+  info.textContent = (occupancy.door || 'Все двери') + (occupancy.ready ? '' : ' — данные ещё загружаются');
+  let head = '<tr><th>День</th>';
+  for(let h = 0; h < 24; h++) head += `<th>${h}</th>`;
+  tbl.tHead.innerHTML = head + '</tr>';
+  for(let i = 0; i < values.length; i += 24){
+    const tr = document.createElement('tr');
+    let html = `<td class="mono">${occupancy.buckets[i].slice(0, 10)}</td>`;
+    values.slice(i, i + 24).forEach(v=>{
+      const a = (v / max).toFixed(2);
+      html += `<td style="background:rgba(0,110,200,${a}); color:${a > 0.6 ? '#fff' : '#000'}">${v || ''}</td>`;
+    });
+    tr.innerHTML = html;
+    tbl.tBodies[0].appendChild(tr);
+  }
+}
+
 async function loadDoors(){
   const r = await fetch('/api/doors');
   const arr = await r.json();
@@ -186,18 +288,52 @@ async function loadDoors(){
   });
 }
 
-async function loadAll(){
-  const f = getFilters();
-  const r1 = await fetch('/api/log?'+qs(f));
-  const log = await r1.json();
-  document.getElementById('loadedInfo').textContent = 'Загружено: ' + log.length;
-  renderLog(log, 'replace');
+// {"cols": [...], "rows": [[...]]} (shape=columnar) -> row objects
+function fromColumns(d){
+  return d.rows.map(r=>{
+    const o = {};
+    d.cols.forEach((c, i)=>{ o[c] = r[i]; });
+    return o;
+  });
+}
+
+async function fetchColumns(url, f){
+  const r = await fetch(url + '?' + qs(Object.assign({}, f, {shape: 'columnar'})));
+  const d = await r.json();
+  return Object.assign(d, {rows: fromColumns(d)});
+}
+
+function setLogPage(page, mode){
+  renderLog(page.rows, mode);
+  loadedCount = (mode === 'replace' ? 0 : loadedCount) + page.rows.length;
+  nextCursor = page.nextCursor;
+  document.getElementById('loadedInfo').textContent = 'Загружено: ' + loadedCount;
+  document.getElementById('logMore').style.display = nextCursor ? 'block' : 'none';
+}
+
+async function loadMore(){
+  if(!nextCursor || loadingMore) return;
+  loadingMore = true;
+  try{
+    const f = getFilters();
+    f.beforeSerial = nextCursor;
+    setLogPage(await fetchColumns('/api/log', f), 'append');
+  } finally {
+    loadingMore = false;
+  }
+}
 
-  const r2 = await fetch('/api/summary?'+qs(f));
-  renderSummary(await r2.json());
+// infinite scroll: fetch the next page when the "load more" row becomes visible
+new IntersectionObserver(entries=>{
+  if(entries.some(e=>e.isIntersecting)) loadMore();
+}).observe(document.getElementById('logMore'));
 
-  const r3 = await fetch('/api/worktime?'+qs(f));
-  renderWorktime(await r3.json());
+async function loadAll(){
+  const f = getFilters();
+  setLogPage(await fetchColumns('/api/log', f), 'replace');
+  renderSummary((await fetchColumns('/api/summary', f)).rows);
+  renderWorktime((await fetchColumns('/api/worktime', f)).rows);
+  await loadOccupancy();
 }
 
 async function applyFilters(){
@@ -217,25 +353,46 @@ function setSseStatus(txt){
   document.getElementById('sseStatus').textContent = 'SSE: ' + txt;
 }
 
-function startLive(){
+function startLive(resume){
   const f = getFilters();
+  if(resume && lastEventId) f.lastEventId = lastEventId;
   const url = '/sse?' + qs(f);
   es = new EventSource(url);
+  const src = es;
   setSseStatus('connecting...');
   es.onopen = ()=> setSseStatus('connected');
-  es.onerror = ()=> setSseStatus('error');
+  es.onerror = ()=>{
+    // EventSource reconnects by itself with Last-Event-ID; if it gave up
+    // (server down), reopen later and resume from the last batch we saw
+    setSseStatus('reconnecting...');
+    if(src.readyState === EventSource.CLOSED){
+      setTimeout(()=>{ if(liveOn && es === src){ es = null; startLive(true); } }, 3000);
+    }
+  };
   es.onmessage = (ev)=>{
+    if(ev.lastEventId) lastEventId = ev.lastEventId;
     try{
       const msg = JSON.parse(ev.data);
-      if(msg.type === 'batch'){
-        if(msg.rows && msg.rows.length){
-          renderLog(msg.rows.slice().reverse(), 'prepend');
-          // quick refresh summary/worktime with same filters (keeps UI accurate)
-          loadAll();
-        }
+      if(msg.type === 'resync'){
+        // server dropped our backlog (slow client) — reload current state
+        loadAll();
       }
     }catch(e){}
   };
+  // typed deltas: patch the tables in place, no REST calls
+  es.addEventListener('log', (ev)=>{
+    const msg = JSON.parse(ev.data);
+    renderLog(msg.rows, 'prepend');
+    loadedCount += msg.rows.length;
+    document.getElementById('loadedInfo').textContent = 'Загружено: ' + loadedCount;
+  });
+  es.addEventListener('presence-delta', (ev)=>{
+    lastEventId = ev.lastEventId;  // last event of a batch
+    patchTable('#summaryTbl', JSON.parse(ev.data).rows, summaryRowHtml);
+  });
+  es.addEventListener('worktime-delta', (ev)=>{
+    patchTable('#workTbl', JSON.parse(ev.data).rows, worktimeRowHtml);
+  });
   liveOn = true;
   document.getElementById('liveBtn').textContent = 'Выключить Live';
 }
@@ -10,6 +10,7 @@ from __future__ import annotations
 
 import re
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Any, Optional
 
 # ===== Time helpers =====
@@ -61,27 +62,33 @@ _MOJIBAKE_MARKERS = (
     "СЂ", "СЃ", "С‚", "Сѓ", "С…", "СЏ", "СЌ", "СЋ", "СЊ"
 )
 
+# one combined pattern instead of a substring scan per marker
+_MOJIBAKE_RE = re.compile("|".join(map(re.escape, _MOJIBAKE_MARKERS)))
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+_LATIN1_GARBAGE_RE = re.compile("[»µ¶°¬¦]")
+
+# distinct raw values are few (doors, people), so repaired strings are memoized
+FIX_CACHE_SIZE = 16384
+
 def is_mojibake_ru(s: str) -> bool:
     """Detect typical 'РџСЂ...' style mojibake."""
     if not s:
         return False
-    if any(m in s for m in _MOJIBAKE_MARKERS):
+    if _MOJIBAKE_RE.search(s):
         return True
     rs = s.count("Р") + s.count("С")
     return rs >= 3 and rs / max(1, len(s)) > 0.12
 
 
 def score_russian(s: str) -> int:
-    return len(re.findall(r"[А-Яа-яЁё]", s))
+    return len(_CYRILLIC_RE.findall(s))
 
 
-def fix_hik_text(s: Any) -> Any:
-    """
-    Fix Hikvision/iVMS mojibake and return best candidate.
-    Keeps original type for non-strings.
-    """
-    if not isinstance(s, str) or not s:
-        return s
+@lru_cache(maxsize=FIX_CACHE_SIZE)
+def _fix_hik_str(s: str) -> str:
+    # plain ASCII (IDs, latin names) can't be mojibake
+    if s.isascii():
+        return s.strip()
 
     candidates: list[str] = [s]
 
@@ -97,12 +104,15 @@ def fix_hik_text(s: Any) -> Any:
                 pass
 
     # 2) Rare case: latin-1 -> cp1251 garbage like '» µ¶ °'
-    if any(ch in s for ch in ("»", "µ", "¶", "°", "¬", "¦")):
+    if _LATIN1_GARBAGE_RE.search(s):
         try:
             candidates.append(s.encode("latin-1", errors="ignore").decode("cp1251", errors="ignore"))
         except Exception:
             pass
 
+    if len(candidates) == 1:
+        return s.strip()
+
     def score(c: str) -> tuple[int, int, int]:
         # prefer non-mojibake; then more Cyrillic; then fewer 'Р'/'С'
         moj = 1 if is_mojibake_ru(c) else 0
@@ -110,8 +120,21 @@ def fix_hik_text(s: Any) -> Any:
         penalty = (c.count("Р") + c.count("С"))
         return (moj, -rus, penalty)
 
-    best = sorted(candidates, key=score)[0]
-    return best.strip()
+    return min(candidates, key=score).strip()
+
+
+def fix_hik_text(s: Any) -> Any:
+    """
+    Fix Hikvision/iVMS mojibake and return best candidate.
+    Keeps original type for non-strings.
+    """
+    if not isinstance(s, str) or not s:
+        return s
+    return _fix_hik_str(s)
+
+
+def fix_cache_info():
+    return _fix_hik_str.cache_info()
 
 
 def to_hik_mojibake(s: Any) -> Any:
@@ -128,5 +151,17 @@ def to_hik_mojibake(s: Any) -> Any:
     except Exception:
         return s
 
+
+def hik_match_key(s: Any) -> Any:
+    """
+    One comparable form for text iVMS stored either way: mojibake is kept as
+    is, clean Russian is turned into the same mojibake. Unlike the repair
+    (which loses "И" for good), applying it to the stored value and to the
+    filter value gives equal keys for equal text, so one predicate matches.
+    """
+    if not isinstance(s, str) or not s:
+        return s
+    return s if is_mojibake_ru(s) else to_hik_mojibake(s)
+
 # Backward compatible alias used by older files
 try_fix_cp1251_mojibake = fix_hik_text